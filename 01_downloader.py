@@ -1,33 +1,29 @@
-import json
 import os
 import re
+import glob
+import json
 import asyncio
 import shutil
 import argparse
 import subprocess
 import time
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from playwright.async_api import async_playwright
 import yt_dlp
+import requests
+from urllib.parse import urljoin
 import config
+import audio_io
+import manifest
+import schedule
 
+M3U8_CACHE_PATH = config.DIR_CACHE / 'm3u8_cache.json'
+# Плееру для поиска плейлиста не нужны картинки, шрифты и сами сегменты видео
+BLOCKED_RESOURCE_TYPES = {'image', 'font', 'media'}
+SEGMENT_EXTS = ('.ts', '.m4s', '.aac', '.mp4')
+FALLBACK_GRACE = 1.0
 
-def clean_name(s):
-    if not s: return "Unknown"
-    s = str(s).strip().replace(':', ' -').replace('/', '_').replace('\\', '_')
-    s = re.sub(r'[?*<>|"]', '', s)
-    return re.sub(r'\s+', ' ', s).strip()
-
-def truncate_string(s, max_len):
-    if len(s) <= max_len: return s
-    return s[:max_len].rstrip() + "..."
-
-def extract_time(iso_date_str):
-    try:
-        dt = datetime.fromisoformat(iso_date_str)
-        return dt.strftime('%H-%M')
-    except:
-        return "00-00"
 
 def is_direct_download_link(url):
     return 'vkvideo.ru' in url or 'vk.com' in url
@@ -40,9 +36,10 @@ def check_ffmpeg():
         return False
 
 
-def compress_video(input_path, output_path):
+def compress_video(input_path, output_path, threads=None):
     print(f"   --> Сжатие: {os.path.basename(input_path)} -> CRF {config.FFMPEG_CRF}")
     
+    threads = threads or ffmpeg_threads(1)
     cmd = [
         "ffmpeg", "-y",
         "-fflags", "+genpts", "-err_detect", "ignore_err",
@@ -51,8 +48,10 @@ def compress_video(input_path, output_path):
         "-c:v", "libx264",
         "-crf", str(config.FFMPEG_CRF),
         "-preset", config.FFMPEG_PRESET,
+        "-threads", str(threads),
         "-c:a", "aac", "-b:a", "128k",
         "-map_metadata", "-1",
+        "-f", "mp4",
         output_path
     ]
 
@@ -76,7 +75,49 @@ def compress_video(input_path, output_path):
         return False
 
 
-async def resolve_m3u8_links(unique_urls):
+def load_m3u8_cache():
+    try:
+        with open(M3U8_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except:
+        return {}
+
+def save_m3u8_cache(cache):
+    os.makedirs(os.path.dirname(M3U8_CACHE_PATH), exist_ok=True)
+    tmp_path = str(M3U8_CACHE_PATH) + ".part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, M3U8_CACHE_PATH)
+
+def hls_headers(referer_url=None):
+    headers = {'User-Agent': config.USER_AGENT}
+    if referer_url:
+        headers['Referer'] = referer_url
+        headers['Origin'] = "https://front.finevid.link"
+    return headers
+
+def ffmpeg_headers(referer_url=None):
+    return "".join(f"{k}: {v}\r\n" for k, v in hls_headers(referer_url).items() if k != 'User-Agent')
+
+def is_playlist_alive(m3u8_url, referer_url):
+    try:
+        with requests.get(m3u8_url, headers=hls_headers(referer_url), timeout=config.M3U8_VALIDATE_TIMEOUT, stream=True) as r:
+            return r.status_code == 200 and next(r.iter_content(64), b'').lstrip().startswith(b'#EXTM3U')
+    except:
+        return False
+
+def lookup_m3u8_cache(urls, cache):
+    now = time.time()
+    candidates = {u: cache[u]['url'] for u in urls
+                  if u in cache and now - cache[u].get('ts', 0) < config.M3U8_CACHE_TTL}
+    if not candidates: return {}
+
+    # Дешевая проверка, что плейлист еще отдается (ссылки бывают с истекающими токенами)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        alive = pool.map(lambda u: is_playlist_alive(candidates[u], u), list(candidates))
+        return {u: candidates[u] for u, ok in zip(list(candidates), alive) if ok}
+
+async def resolve_m3u8_links(unique_urls, use_cache=True):
     results = {}
     browser_urls = [u for u in unique_urls if not is_direct_download_link(u)]
     direct_urls = [u for u in unique_urls if is_direct_download_link(u)]
@@ -84,50 +125,92 @@ async def resolve_m3u8_links(unique_urls):
     for url in direct_urls: results[url] = url
     if not browser_urls: return results
 
+    cache = load_m3u8_cache() if use_cache else {}
+    if cache:
+        cached = await asyncio.to_thread(lookup_m3u8_cache, browser_urls, cache)
+        results.update(cached)
+        browser_urls = [u for u in browser_urls if u not in cached]
+        print(f"--- Кэш m3u8: {len(cached)} ссылок, в браузер: {len(browser_urls)} ---")
+    if not browser_urls: return results
+
     CONCURRENCY = 8
     print(f"--- Запуск Chrome (Headless) для {len(browser_urls)} ссылок ---")
     
     async with async_playwright() as p:
         browser = await p.chromium.launch(channel="chrome", headless=True, args=["--autoplay-policy=no-user-gesture-required", "--mute-audio"])
-        semaphore = asyncio.Semaphore(CONCURRENCY)
-        
-        async def process_url(url, idx, total):
-            async with semaphore:
-                context = await browser.new_context(user_agent=config.USER_AGENT)
-                page = await context.new_page()
-                found_m3u8 = None
-                
-                def handle_request(req):
-                    nonlocal found_m3u8
-                    if config.TARGET_M3U8_PART in req.url: found_m3u8 = req.url
-                    elif '.m3u8' in req.url and not found_m3u8: found_m3u8 = req.url
-
-                page.on("request", handle_request)
-                try:
-                    await page.goto(url, wait_until="domcontentloaded", timeout=20000)
-                    try: await page.wait_for_selector('video', timeout=4000)
-                    except: pass 
-                    for _ in range(50):
-                        if found_m3u8: break
-                        await page.wait_for_timeout(100)
-                    
-                    if found_m3u8:
-                        results[url] = found_m3u8
-                        print(f"[{idx}/{total}] [+] {found_m3u8.split('/')[-1]}")
-                    else:
-                        print(f"[{idx}/{total}] [-] FAIL: {url}")
-                except Exception as e:
-                    print(f"[{idx}/{total}] [!] {e}")
-                finally:
-                    await context.close()
-
-        tasks = [process_url(url, i, len(browser_urls)) for i, url in enumerate(browser_urls, 1)]
-        await asyncio.gather(*tasks)
+        url_queue = asyncio.Queue()
+        for i, url in enumerate(browser_urls, 1): url_queue.put_nowait((i, url))
+        total = len(browser_urls)
+
+        async def block_heavy(route):
+            req = route.request
+            path = req.url.split('?')[0].lower()
+            if '.m3u8' not in path and (req.resource_type in BLOCKED_RESOURCE_TYPES or path.endswith(SEGMENT_EXTS)):
+                await route.abort()
+            else:
+                await route.continue_()
+
+        async def process_url(context, url, idx):
+            page = await context.new_page()
+            found = asyncio.get_running_loop().create_future()
+            fallback = None
+
+            # Возвращаемся сразу по событию запроса, без опроса по таймеру
+            def handle_request(req):
+                nonlocal fallback
+                if found.done() or '.m3u8' not in req.url: return
+                if config.TARGET_M3U8_PART in req.url: found.set_result(req.url)
+                elif not fallback:
+                    # Любой .m3u8 подойдет, если нужный так и не появится за короткую паузу
+                    fallback = req.url
+                    asyncio.get_running_loop().call_later(FALLBACK_GRACE, lambda: found.done() or found.set_result(fallback))
+
+            page.on("request", handle_request)
+            nav = asyncio.create_task(page.goto(url, wait_until="domcontentloaded", timeout=20000))
+            try:
+                found_m3u8 = await asyncio.wait_for(asyncio.shield(found), timeout=config.M3U8_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                found_m3u8 = fallback
+            finally:
+                nav.cancel()
+                await page.close()
+                await asyncio.gather(nav, return_exceptions=True)
+
+            if found_m3u8:
+                results[url] = found_m3u8
+                cache[url] = {'url': found_m3u8, 'ts': time.time()}
+                print(f"[{idx}/{total}] [+] {found_m3u8.split('/')[-1]}")
+            else:
+                print(f"[{idx}/{total}] [-] FAIL: {url}")
+
+        async def worker():
+            # Один контекст на воркер, новая вкладка на ссылку
+            context = await browser.new_context(user_agent=config.USER_AGENT)
+            if config.M3U8_LEAN_BROWSER:
+                await context.route("**/*", block_heavy)
+            try:
+                while not url_queue.empty():
+                    idx, url = url_queue.get_nowait()
+                    try:
+                        await process_url(context, url, idx)
+                    except Exception as e:
+                        print(f"[{idx}/{total}] [!] {e}")
+            finally:
+                await context.close()
+
+        await asyncio.gather(*[worker() for _ in range(min(CONCURRENCY, total))])
         await browser.close()
+
+    if use_cache:
+        save_m3u8_cache(cache)
     return results
 
 
-def download_and_process(source_url, final_target_path, temp_dir, referer_url=None):
+def ffmpeg_threads(workers):
+    # Делим ядра между параллельными кодировщиками, чтобы они не дрались за CPU
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def check_existing_target(final_target_path):
     if os.path.exists(final_target_path):
         if os.path.getsize(final_target_path) < 1024:
              print(f"   [WARN] Найден пустой файл {os.path.basename(final_target_path)}. Перекачиваем.")
@@ -135,64 +218,68 @@ def download_and_process(source_url, final_target_path, temp_dir, referer_url=No
         else:
              print(f"   -> Файл уже готов: {os.path.basename(final_target_path)}")
              return True
+    return False
 
+def download_raw(source_url, final_target_path, temp_dir, referer_url=None, quiet=False):
     filename = os.path.basename(final_target_path)
     raw_filename = "RAW_" + filename
     raw_path = os.path.join(temp_dir, raw_filename)
     part_path = raw_path + ".part"
 
-    if not os.path.exists(raw_path):
-        print(f"   --> Скачивание RAW: {filename}")
-        
-        http_headers = {
-            'User-Agent': config.USER_AGENT,
-        }
-        if referer_url:
-            http_headers['Referer'] = referer_url
-            http_headers['Origin'] = "https://front.finevid.link"
-
-        ydl_opts = {
-            'outtmpl': raw_path,
-            'format': 'best',
-            'quiet': False, 
-            'no_warnings': False,
-            'concurrent_fragment_downloads': 8,
-            'trim_file_name': 200,
-            'http_headers': http_headers,
-            'retries': 10,
-            'fragment_retries': 10,
-            'skip_unavailable_fragments': True,
-            'ignoreerrors': True,
-            'abort_on_unavailable_fragment': False,
-            'hls_use_mpegts': True, 
-        }
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([source_url])
-        except Exception as e:
-            print(f"   [WARN] yt-dlp завершился с ошибкой (проверяем файл...): {e}")
-
-        if os.path.exists(raw_path): pass
-        elif os.path.exists(part_path):
-            print(f"   [WARN] Восстановление из .part...")
-            try: shutil.move(part_path, raw_path)
-            except: pass
-        
-        if not os.path.exists(raw_path):
-             print(f"   [FAIL] Не удалось скачать файл.")
-             return False
-    else:
+    if os.path.exists(raw_path):
         print(f"   --> Найден загруженный RAW: {filename}")
+        return raw_path
 
+    print(f"   --> Скачивание RAW: {filename}")
+    
+    http_headers = hls_headers(referer_url)
+
+    ydl_opts = {
+        'outtmpl': raw_path,
+        'format': 'best',
+        'quiet': quiet, 
+        'noprogress': quiet,
+        'no_warnings': False,
+        'concurrent_fragment_downloads': 8,
+        'trim_file_name': 200,
+        'http_headers': http_headers,
+        'retries': 10,
+        'fragment_retries': 10,
+        'skip_unavailable_fragments': True,
+        'ignoreerrors': True,
+        'abort_on_unavailable_fragment': False,
+        'hls_use_mpegts': True, 
+    }
+    
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([source_url])
+    except Exception as e:
+        print(f"   [WARN] yt-dlp завершился с ошибкой (проверяем файл...): {e}")
+
+    if os.path.exists(raw_path): pass
+    elif os.path.exists(part_path):
+        print(f"   [WARN] Восстановление из .part...")
+        try: shutil.move(part_path, raw_path)
+        except: pass
+    
+    if not os.path.exists(raw_path):
+         print(f"   [FAIL] Не удалось скачать файл.")
+         return None
+    return raw_path
+
+def finalize_raw(raw_path, final_target_path, threads=None):
     if config.COMPRESS_VIDEO:
         if os.path.getsize(raw_path) < 1024:
              print("   [FAIL] RAW файл пустой (возможно, бан по IP или ошибка доступа). Удаляем.")
              os.remove(raw_path)
              return False
 
-        success = compress_video(raw_path, final_target_path)
+        # Пишем во временный файл: недописанное видео не должно выглядеть готовым
+        part_target = final_target_path + ".part"
+        success = compress_video(raw_path, part_target, threads)
         if success:
+            os.replace(part_target, final_target_path)
             try: os.remove(raw_path)
             except: pass
             return True
@@ -206,15 +293,357 @@ def download_and_process(source_url, final_target_path, temp_dir, referer_url=No
             print(f"   [FAIL] Ошибка перемещения: {e}")
             return False
 
+def download_single_pass(source_url, final_target_path, referer_url=None, threads=None):
+    # HLS идет прямо в один ffmpeg с двумя выходами: MP4 и WAV 16 кГц для транскрибера.
+    # Без RAW-файла в temp_raw и без повторного декодирования в 02_extractor.
+    audio_path = str(manifest.stage_path(manifest.rel_path_of('video', final_target_path), 'audio'))
+    os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+    video_part, audio_part = final_target_path + ".part", audio_path + ".part"
+
+    if config.COMPRESS_VIDEO:
+        video_codec = [
+            "-vf", f"scale={config.FFMPEG_SCALE}",
+            "-c:v", "libx264",
+            "-crf", str(config.FFMPEG_CRF),
+            "-preset", config.FFMPEG_PRESET,
+            "-threads", str(threads or ffmpeg_threads(1)),
+            "-c:a", "aac", "-b:a", "128k",
+        ]
+    else:
+        video_codec = ["-c", "copy"]
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-user_agent", config.USER_AGENT,
+        "-headers", ffmpeg_headers(referer_url),
+        "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "10",
+        "-fflags", "+genpts", "-err_detect", "ignore_err",
+        "-i", source_url,
+        # Без -map: для каждого выхода ffmpeg сам выберет лучший вариант потока из плейлиста
+        *video_codec,
+        "-map_metadata", "-1",
+        "-f", "mp4", video_part,
+        "-vn", "-sn", "-dn",
+        *audio_io.ffmpeg_output_args(audio_part),
+    ]
+
+    print(f"   --> Скачивание + сжатие + аудио за один проход: {os.path.basename(final_target_path)}")
+    start_t = time.time()
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+
+    if result.returncode != 0 or not os.path.exists(video_part) or os.path.getsize(video_part) < 1024:
+        print(f"   [FAIL] Ошибка FFmpeg. Лог:")
+        print("="*20 + "\n" + result.stderr[-500:] + "\n" + "="*20)
+        for path in [video_part, audio_part]:
+            try: os.remove(path)
+            except: pass
+        return False
+
+    os.replace(video_part, final_target_path)
+    audio_io.finalize(audio_part, audio_path)
+    manifest.mark_done('audio', audio_path)
+
+    new_size = os.path.getsize(final_target_path) / (1024*1024)
+    print(f"   [OK] Готово за {int(time.time() - start_t)}с. MP4 {new_size:.1f}MB + WAV")
+    return True
+
+def use_single_pass(source_url):
+    return config.SINGLE_PASS and not is_direct_download_link(source_url)
+
+def parse_master_playlist(text, base_url):
+    audio_renditions, variants = [], []
+    lines = [l.strip() for l in text.splitlines()]
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-MEDIA:') and 'TYPE=AUDIO' in line:
+            uri = re.search(r'URI="([^"]+)"', line)
+            language = re.search(r'LANGUAGE="([^"]*)"', line)
+            default = re.search(r'[:,]DEFAULT=(YES|NO)', line)
+            if uri:
+                audio_renditions.append({
+                    'uri': urljoin(base_url, uri.group(1)),
+                    'language': language.group(1).lower() if language else "",
+                    'default': bool(default and default.group(1) == 'YES'),
+                })
+        elif line.startswith('#EXT-X-STREAM-INF:'):
+            bandwidth = re.search(r'[:,]BANDWIDTH=(\d+)', line)
+            codecs = re.search(r'CODECS="([^"]+)"', line)
+            uri = next((l for l in lines[i + 1:] if l and not l.startswith('#')), None)
+            if uri:
+                variants.append((int(bandwidth.group(1)) if bandwidth else 0, codecs.group(1) if codecs else "", urljoin(base_url, uri)))
+    return audio_renditions, variants
+
+def pick_audio_rendition(renditions):
+    # Несколько дорожек (дубляж): русская, иначе DEFAULT=YES, иначе первая
+    russian = [r for r in renditions if r['language'].split('-')[0] in ('ru', 'rus')]
+    default = [r for r in renditions if r['default']]
+    return (russian or default or renditions)[0]['uri']
+
+def pick_audio_source(m3u8_url, referer_url=None):
+    # Отдельная аудио-дорожка, иначе аудио-вариант, иначе самый легкий вариант плейлиста
+    try:
+        r = requests.get(m3u8_url, headers=hls_headers(referer_url), timeout=config.M3U8_VALIDATE_TIMEOUT)
+        r.raise_for_status()
+    except Exception as e:
+        print(f"   [WARN] Не удалось прочитать плейлист ({e}), берем как есть.")
+        return m3u8_url
+
+    audio_renditions, variants = parse_master_playlist(r.text, m3u8_url)
+    if audio_renditions:
+        return pick_audio_rendition(audio_renditions)
+    audio_variants = [v for v in variants if v[1] and all(c.startswith('mp4a') for c in v[1].split(','))]
+    if audio_variants or variants:
+        return min(audio_variants or variants)[2]
+    return m3u8_url
+
+def download_direct_audio(source_url, audio_path, referer_url=None):
+    # Прямая ссылка VK — страница, а не плейлист: ffmpeg ее не откроет, дорожку скачивает yt-dlp
+    raw_base = os.path.join(config.TEMP_DIR, "RAW_AUDIO_" + os.path.splitext(os.path.basename(audio_path))[0])
+    os.makedirs(config.TEMP_DIR, exist_ok=True)
+    ydl_opts = {
+        'outtmpl': raw_base + '.%(ext)s',
+        'format': 'bestaudio/worst',
+        'quiet': True,
+        'noprogress': True,
+        'http_headers': hls_headers(referer_url),
+        'retries': 10,
+        'fragment_retries': 10,
+        'ignoreerrors': True,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([source_url])
+    except Exception as e:
+        print(f"   [WARN] yt-dlp завершился с ошибкой (проверяем файл...): {e}")
+
+    found = [p for p in glob.glob(glob.escape(raw_base) + '.*') if not p.endswith('.part')]
+    if not found:
+        print(f"   [FAIL] Не удалось скачать аудио.")
+        return None
+    return found[0]
+
+def download_audio_only(source_url, audio_path, referer_url=None):
+    os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+    audio_part = audio_path + ".part"
+
+    raw_path = None
+    if is_direct_download_link(source_url):
+        raw_path = download_direct_audio(source_url, audio_path, referer_url)
+        if not raw_path: return False
+        input_args = ["-i", raw_path]
+    else:
+        input_url = pick_audio_source(source_url, referer_url)
+        input_args = [
+            "-user_agent", config.USER_AGENT,
+            "-headers", ffmpeg_headers(referer_url),
+            "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "10",
+            "-i", input_url,
+        ]
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        *input_args,
+        "-map", "0:a:0", "-vn", "-sn", "-dn",
+        *audio_io.ffmpeg_output_args(audio_part),
+    ]
+
+    print(f"   --> Только аудио: {input_args[-1].split('/')[-1].split('?')[0]} -> {os.path.basename(audio_path)}")
+    start_t = time.time()
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+    if raw_path:
+        try: os.remove(raw_path)
+        except: pass
+
+    if result.returncode != 0 or not os.path.exists(audio_part) or os.path.getsize(audio_part) < 1024:
+        print(f"   [FAIL] Ошибка FFmpeg. Лог:")
+        print("="*20 + "\n" + result.stderr[-500:] + "\n" + "="*20)
+        try: os.remove(audio_part)
+        except: pass
+        return False
+
+    audio_io.finalize(audio_part, audio_path)
+    print(f"   [OK] Аудио за {int(time.time() - start_t)}с. {os.path.getsize(audio_path) / (1024*1024):.1f}MB")
+    return True
+
+def task_output(task):
+    # В режиме "только аудио" результат этапа — WAV в output_audio, а не MP4
+    if config.AUDIO_ONLY:
+        return 'audio', str(manifest.stage_path(manifest.rel_path_of('video', task['target_path']), 'audio'))
+    return 'video', task['target_path']
+
+def download_and_process(source_url, final_target_path, temp_dir, referer_url=None):
+    if check_existing_target(final_target_path):
+        return True
+    if use_single_pass(source_url):
+        return download_single_pass(source_url, final_target_path, referer_url)
+
+    raw_path = download_raw(source_url, final_target_path, temp_dir, referer_url)
+    if not raw_path:
+        return False
+    return finalize_raw(raw_path, final_target_path)
+
+def collect_tasks(records, only_missing=True):
+    tasks = [{k: r[k] for k in ('topic_id', 'player_url', 'target_path', 'title')} for r in records]
+
+    manifest.ensure_synced()
+    manifest.register_topics(tasks)
+    if only_missing:
+        pending = {row['topic_id'] for row in manifest.plan('audio' if config.AUDIO_ONLY else 'video',
+                                                          topic_ids={t['topic_id'] for t in tasks}, require_prev=False)}
+        tasks = [t for t in tasks if t['topic_id'] in pending]
+    return tasks
+
+def process_task(task, m3u8_map, processed_files_cache):
+    source_url = m3u8_map[task['player_url']]
+    key = manifest.source_key(source_url)
+    stage, target_path = task_output(task)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+    # Тот же поток уже скачан (в этом или прошлом запуске) — ссылка вместо загрузки
+    existing = processed_files_cache.get(key) or manifest.find_source_artifact(stage, key)
+    if existing and os.path.exists(existing):
+        try:
+            # Вместе с файлом — его спутники (.s16.json), иначе дубль .s16 без частоты и длины
+            method = manifest.link_duplicate(existing, target_path)
+            print(f"   --> Дубль ({method}): {os.path.basename(target_path)}")
+            manifest.mark_done(stage, target_path)
+            return True
+        except Exception as e:
+            manifest.mark_failed(stage, target_path, e)
+            return False
+
+    manifest.mark_running(stage, target_path)
+    if config.AUDIO_ONLY:
+        success = download_audio_only(source_url, target_path, referer_url=task['player_url'])
+    else:
+        success = download_and_process(source_url, target_path, config.TEMP_DIR, referer_url=task['player_url'])
+    if success and os.path.exists(target_path):
+        processed_files_cache[key] = target_path
+        manifest.mark_done(stage, target_path)
+        return True
+    manifest.mark_failed(stage, target_path)
+    return False
+
+def run_pools(tasks, m3u8_map, download_workers, compress_workers):
+    stats = {'ok': 0, 'fail': 0}
+    lock = threading.Lock()
+    threads = ffmpeg_threads(compress_workers)
+    quiet = download_workers > 1
+    # Не даем загрузкам убежать далеко вперед кодировщиков и забить temp_raw
+    slots = threading.BoundedSemaphore(download_workers + compress_workers * 2)
+
+    def count(ok):
+        with lock: stats['ok' if ok else 'fail'] += 1
+
+    by_source = {}
+    for task in tasks:
+        if task['player_url'] not in m3u8_map:
+            print(f"SKIP: Нет видео: {task['title']}")
+            count(False)
+            continue
+        by_source.setdefault(manifest.source_key(m3u8_map[task['player_url']]), []).append(task)
+
+    def finish(source_url, group, ok):
+        primary = group[0]['target_path']
+        if ok: manifest.mark_done('video', primary)
+        else: manifest.mark_failed('video', primary)
+        count(ok)
+        # Остальные лекции с тем же потоком получают ссылку на готовый файл
+        for task in group[1:]:
+            if ok:
+                count(process_task(task, m3u8_map, {manifest.source_key(source_url): primary}))
+            else:
+                manifest.mark_failed('video', task['target_path'])
+                count(False)
+
+    def compress_job(source_url, group, raw_path):
+        try:
+            ok = finalize_raw(raw_path, group[0]['target_path'], threads)
+        except Exception as e:
+            print(f"   [FAIL] {group[0]['title']}: {e}")
+            ok = False
+        finally:
+            slots.release()
+        finish(source_url, group, ok)
+
+    def single_pass_job(source_url, group):
+        primary = group[0]
+        try:
+            os.makedirs(os.path.dirname(primary['target_path']), exist_ok=True)
+            manifest.mark_running('video', primary['target_path'])
+            ok = check_existing_target(primary['target_path']) or \
+                 download_single_pass(source_url, primary['target_path'], primary['player_url'], threads)
+        except Exception as e:
+            print(f"   [FAIL] {primary['title']}: {e}")
+            ok = False
+        finish(source_url, group, ok)
+
+    def audio_job(source_url, group):
+        cache = {}
+        for task in group:
+            try:
+                ok = process_task(task, m3u8_map, cache)
+            except Exception as e:
+                print(f"   [FAIL] {task['title']}: {e}")
+                ok = False
+            count(ok)
+
+    def download_job(source_url, group):
+        slots.acquire()
+        primary = group[0]
+        try:
+            os.makedirs(os.path.dirname(primary['target_path']), exist_ok=True)
+            manifest.mark_running('video', primary['target_path'])
+            if check_existing_target(primary['target_path']):
+                raw_path, ready = None, True
+            else:
+                raw_path = download_raw(source_url, primary['target_path'], config.TEMP_DIR, primary['player_url'], quiet)
+                ready = False
+        except Exception as e:
+            print(f"   [FAIL] {primary['title']}: {e}")
+            raw_path, ready = None, False
+
+        if raw_path:
+            compress_pool.submit(compress_job, source_url, group, raw_path)
+        else:
+            slots.release()
+            finish(source_url, group, ready)
+
+    print(f"Потоков: загрузка {download_workers}, сжатие {compress_workers} (ffmpeg -threads {threads})")
+    with ThreadPoolExecutor(max_workers=compress_workers) as compress_pool:
+        with ThreadPoolExecutor(max_workers=download_workers) as download_pool:
+            for key, group in by_source.items():
+                group.sort(key=lambda t: t['topic_id'])
+                source_url = m3u8_map[group[0]['player_url']]
+                stage = task_output(group[0])[0]
+                if manifest.find_source_artifact(stage, key):
+                    for task in group: count(process_task(task, m3u8_map, {}))
+                    continue
+                # В однопроходном режиме загрузка и кодирование — один процесс ffmpeg
+                if config.AUDIO_ONLY:
+                    download_pool.submit(audio_job, source_url, group)
+                elif use_single_pass(source_url):
+                    compress_pool.submit(single_pass_job, source_url, group)
+                else:
+                    download_pool.submit(download_job, source_url, group)
+
+    return stats
+
 def main():
     parser = argparse.ArgumentParser(description="AIJ Downloader Pro")
     subparsers = parser.add_subparsers(dest='command', help='Commands', required=True)
     
     dl_parser = subparsers.add_parser('download', help='Скачать лекции')
-    dl_parser.add_argument('--halls', nargs='+', default=[], help='Фильтр залов')
     dl_parser.add_argument('--all', action='store_true', help='Скачать ВСЕ залы')
     
     retry_parser = subparsers.add_parser('retry', help='Повторить скачивание')
+
+    for p in [dl_parser, retry_parser]:
+        schedule.add_filter_args(p)
+        p.add_argument('--download-workers', type=int, default=config.DOWNLOAD_WORKERS, help='Параллельных загрузок yt-dlp')
+        p.add_argument('--compress-workers', type=int, default=config.COMPRESS_WORKERS, help='Параллельных сжатий ffmpeg')
+        p.add_argument('--no-m3u8-cache', action='store_true', help='Игнорировать кэш ссылок m3u8')
+        p.add_argument('--single-pass', action='store_true', help='Один ffmpeg: HLS -> MP4 + WAV 16 кГц без RAW-файла')
+        p.add_argument('--audio-only', action='store_true', help='Только WAV 16 кГц из самой легкой дорожки, без видео')
     
     clean_parser = subparsers.add_parser('clean', help='Очистить кэш')
     args = parser.parse_args()
@@ -229,100 +658,39 @@ def main():
 
     if args.command in ['download', 'retry']:
         is_retry = (args.command == 'retry')
+        if args.single_pass: config.SINGLE_PASS = True
+        if args.audio_only: config.AUDIO_ONLY = True
         
-        if config.COMPRESS_VIDEO and not check_ffmpeg():
+        if (config.COMPRESS_VIDEO or config.AUDIO_ONLY) and not check_ffmpeg():
             print("\n[!!!] FFMPEG НЕ НАЙДЕН. Скачайте ffmpeg.exe.")
             return
 
         for d in [config.OUTPUT_DIR, config.TEMP_DIR]:
             if not os.path.exists(d): os.makedirs(d)
 
-        with open(config.JSON_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        tasks = []
-        unique_player_urls = set()
-        
-        target_halls = []
         if is_retry or args.all:
-            target_halls = []
-            print("Режим: Заполнение пропусков (Все залы)" if is_retry else "Режим: Скачивание (Все залы)")
-        elif args.halls:
-            target_halls = [h.lower() for h in args.halls]
-            print(f"Режим: Выбранные залы {args.halls}")
+            print("Режим: Заполнение пропусков" if is_retry else "Режим: Скачивание (Все залы)")
+        elif schedule.has_filters(args):
+            print(f"Режим: Выборка (дни {args.days}, залы {args.halls}, спикеры {args.speakers}, теги {args.tags}, id {args.ids})")
         else:
-            print("Используйте: download --all ИЛИ retry")
+            print("Используйте: download --all | download --halls/--days/--speakers/--tags/--ids ... | retry")
             return
 
         print("\n--- 1. Поиск недостающих файлов ---")
-        for day in data:
-            for hall in day.get('halls', []):
-                hall_name = hall.get('name', 'Unknown')
-                if target_halls and not any(th in hall_name.lower() for th in target_halls):
-                    continue
-
-                for topic in hall.get('topics', []):
-                    if topic.get('isBreak') or not topic.get('videos'): continue
-                    player_url = topic['videos'][0].get('videoUrl')
-                    if not player_url: continue
-
-                    date_folder = clean_name(day.get('concreteDate'))
-                    hall_folder = clean_name(hall_name)
-                    safe_title = truncate_string(clean_name(topic.get('title')), config.MAX_TITLE_LEN)
-                    safe_speaker = truncate_string(clean_name(", ".join(filter(None, [s.get('fullName') for s in topic.get('speakers', [])]))) or "Speaker", config.MAX_SPEAKER_LEN)
-                    time_str = extract_time(topic.get('startDate'))
-                    
-                    filename = config.FILENAME_FORMAT.format(time=time_str, speaker=safe_speaker, title=safe_title)
-                    if len(filename) > config.MAX_FILENAME_LENGTH:
-                        name_part, ext = os.path.splitext(filename)
-                        filename = name_part[:config.MAX_FILENAME_LENGTH] + ext
-                    
-                    target_path = os.path.join(config.OUTPUT_DIR, date_folder, hall_folder, filename)
-                    
-                    if not os.path.exists(target_path):
-                        unique_player_urls.add(player_url)
-                        tasks.append({
-                            'player_url': player_url,
-                            'target_path': target_path,
-                            'title': filename
-                        })
+        tasks = collect_tasks(schedule.select(args))
+        unique_player_urls = {t['player_url'] for t in tasks}
 
         print(f"Необходимо скачать: {len(tasks)} файлов.")
         if len(tasks) == 0:
             print("Все файлы уже скачаны!")
             return
 
-        m3u8_map = asyncio.run(resolve_m3u8_links(list(unique_player_urls)))
+        m3u8_map = asyncio.run(resolve_m3u8_links(list(unique_player_urls), use_cache=not args.no_m3u8_cache))
+        manifest.set_sources(tasks, m3u8_map)
         
         print("\n--- 3. Обработка ---")
         
-        stats = {'ok': 0, 'fail': 0}
-        processed_files_cache = {}
-
-        for i, task in enumerate(tasks, 1):
-            p_url = task['player_url']
-            if p_url not in m3u8_map:
-                print(f"[{i}] SKIP: Нет видео")
-                stats['fail'] += 1
-                continue
-            
-            source_url = m3u8_map[p_url]
-            target_path = task['target_path']
-
-            if source_url in processed_files_cache and os.path.exists(processed_files_cache[source_url]):
-                print(f"[{i}/{len(tasks)}] Копирование: {os.path.basename(target_path)}")
-                try: 
-                    shutil.copyfile(processed_files_cache[source_url], target_path)
-                    stats['ok'] += 1
-                except: stats['fail'] += 1
-            else:
-                print(f"[{i}/{len(tasks)}] Загрузка: {os.path.basename(target_path)}")
-                success = download_and_process(source_url, target_path, config.TEMP_DIR, referer_url=p_url)
-                if success and os.path.exists(target_path):
-                    processed_files_cache[source_url] = target_path
-                    stats['ok'] += 1
-                else:
-                    stats['fail'] += 1
+        stats = run_pools(tasks, m3u8_map, max(1, args.download_workers), max(1, args.compress_workers))
 
         print("\n" + "="*30)
         print(f"ИТОГ: Успешно: {stats['ok']} | Провалено: {stats['fail']}")
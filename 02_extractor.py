@@ -1,8 +1,13 @@
 import os
+import argparse
 import subprocess
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import config
+import audio_io
+import manifest
+import schedule
 
 INPUT_DIR = config.DIR_VIDEO_RAW
 OUTPUT_DIR = config.DIR_AUDIO_WAV
@@ -12,38 +17,75 @@ def check_ffmpeg():
         os.environ["PATH"] += os.pathsep + os.getcwd()
 
 def convert_to_wav16k(video_path, audio_path):
-    # -ac 1: моно
-    # -ar 16000: 16 кГц (стандарт для речевых моделей)
-    # -vn: убрать видео
+    # -vn/-sn/-dn на входе + -map 0:a:0: видео не демультиплексируется в декодер и не декодируется
+    # -ac 1 -ar 16000: моно 16 кГц (стандарт для речевых моделей), формат — config.AUDIO_FORMAT
+    # -threads 1: параллелим по файлам, а не внутри одного ffmpeg
+    # Пишем во временный файл и переименовываем только после успешного завершения
+    part_path = Path(str(audio_path) + ".part")
     cmd = [
-        "ffmpeg", "-n",          # -n: не перезаписывать, если есть
+        "ffmpeg", "-y",
         "-loglevel", "error",
+        "-vn", "-sn", "-dn",
         "-i", str(video_path),
-        "-vn",
-        "-acodec", "pcm_s16le",
-        "-ar", "16000",
-        "-ac", "1",
-        str(audio_path)
+        "-map", "0:a:0",
+        "-threads", "1",
+        *audio_io.ffmpeg_output_args(part_path)
     ]
-    subprocess.run(cmd)
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+    if result.returncode != 0:
+        part_path.unlink(missing_ok=True)
+        raise RuntimeError(f"ffmpeg exit {result.returncode}: {result.stderr.strip()[-300:]}")
+    audio_io.finalize(part_path, audio_path)
+
+def get_audio_path(video_path):
+    relative_path = Path(video_path).relative_to(INPUT_DIR)
+    return OUTPUT_DIR / relative_path.with_suffix(audio_io.AUDIO_EXT)
+
+def extract_one(video_path):
+    audio_path = get_audio_path(video_path)
+    if manifest.is_done('audio', audio_path):
+        return audio_path
+
+    audio_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest.mark_running('audio', audio_path)
+    try:
+        convert_to_wav16k(video_path, audio_path)
+    except Exception as e:
+        manifest.mark_failed('audio', audio_path, e)
+        raise
+    manifest.mark_done('audio', audio_path)
+    return audio_path
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract 16 kHz mono audio from downloaded videos")
+    parser.add_argument("--workers", type=int, default=config.EXTRACT_WORKERS, help="Parallel ffmpeg processes")
+    schedule.add_filter_args(parser)
+    args = parser.parse_args()
+
     check_ffmpeg()
+    manifest.ensure_synced()
     
-    video_files = list(INPUT_DIR.rglob("*.mp4"))
-    print(f"Found {len(video_files)} video files.")
-    
-    pbar = tqdm(video_files, desc="Extracting Audio")
+    video_files = [Path(row['input_path']) for row in manifest.plan('audio', topic_ids=schedule.selected_topic_ids(args))]
+    workers = max(1, args.workers)
+    print(f"Found {len(video_files)} video files to extract. Workers: {workers}")
     
-    for video_path in pbar:
-        relative_path = video_path.relative_to(INPUT_DIR)
-        audio_path = OUTPUT_DIR / relative_path.with_suffix(".wav")
-        
-        if audio_path.exists():
-            continue
-            
-        audio_path.parent.mkdir(parents=True, exist_ok=True)
-        convert_to_wav16k(video_path, audio_path)
+    failed = []
+    pbar = tqdm(total=len(video_files), desc="Extracting Audio", unit="file")
+    # Каждый ffmpeg — отдельный процесс, потокам остается только ждать их завершения
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract_one, video_path): video_path for video_path in video_files}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append((futures[future], e))
+                pbar.set_postfix_str(f"failed: {len(failed)}")
+            pbar.update(1)
+    pbar.close()
+
+    print(f"\nDone. OK: {len(video_files) - len(failed)}, Failed: {len(failed)}")
+    for video_path, e in failed:
+        print(f"  [FAIL] {video_path.name}: {e}")
 
 if __name__ == "__main__":
     main()
@@ -6,17 +6,31 @@ import argparse
 import logging
 import soundfile as sf
 import numpy as np
+import json
 import hashlib
+import tempfile
+import itertools
+import queue
+import threading
+import multiprocessing
 from pathlib import Path
 from tqdm import tqdm
-from difflib import SequenceMatcher
 from transformers import AutoModel
 import config
+import audio_io
+import vad
+import transcript
+import punctuate
+import acoustic
+import stt_backend
+import manifest
+import schedule
 
 logging.getLogger("transformers").setLevel(logging.ERROR)
 
 CHUNK_DURATION = 20.0 
 OVERLAP = 2.0
+STT_MEM_PER_SECOND = 8 * 1024 * 1024  # ~байт VRAM/RAM на секунду аудио в батче (эмпирически, с запасом)
 
 def clean_huggingface_cache():
     home = Path.home()
@@ -27,80 +41,318 @@ def clean_huggingface_cache():
         try: shutil.rmtree(target_dir)
         except: pass
 
-def get_audio_files(directory):
-    return list(directory.rglob("*.wav"))
+def fixed_spans(total_samples, sr):
+    chunk_samples = int(CHUNK_DURATION * sr)
+    overlap_samples = int(OVERLAP * sr)
+    step = chunk_samples - overlap_samples
+    for i in range(0, total_samples, step):
+        if total_samples - i < sr: break
+        yield i, min(i + chunk_samples, total_samples)
 
-def smart_merge(text1, text2):
-    if not text1: return text2
-    if not text2: return text1
+def chunk_spans(audio, sr):
+    if config.CHUNK_MODE == "vad":
+        return vad.speech_chunks(audio, sr)
+    return list(fixed_spans(audio_io.num_samples(audio), sr))
 
-    look_back = min(len(text1), 100) 
-    look_forward = min(len(text2), 100)
-    
-    tail = text1[-look_back:]
-    head = text2[:look_forward]
-    
-    matcher = SequenceMatcher(None, tail, head)
-    match = matcher.find_longest_match(0, len(tail), 0, len(head))
-    
-    if match.size > 5:
-        return text1 + " " + text2[match.b + match.size:]
+def get_asr(model):
+    # HF-обертка GigaAM (trust_remote_code) хранит саму модель в .model;
+    # батчевый путь нужен forward + decoding, иначе остается model.transcribe(path)
+    asr = getattr(model, "model", model)
+    if all(hasattr(asr, name) for name in ("forward", "head", "decoding")):
+        return asr
+    return None
+
+def available_ram():
+    # Linux: MemAvailable из /proc/meminfo; иначе psutil, если установлен; None — неизвестно
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'): return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return None
+
+def auto_batch_size(chunk_samples, sr):
+    if config.STT_BATCH_SIZE: return config.STT_BATCH_SIZE
+    per_chunk = chunk_samples / sr * STT_MEM_PER_SECOND
+    if str(config.DEVICE).startswith("cuda") and torch.cuda.is_available():
+        free_bytes, _ = torch.cuda.mem_get_info()
+        return max(1, min(config.STT_MAX_BATCH, int(free_bytes * 0.8 // per_chunk)))
+    # CPU: свободная RAM делится между процессами пула, половина остается системе и ОС-кэшу
+    free_bytes = available_ram()
+    if free_bytes is None: return config.STT_CPU_BATCH
+    share = free_bytes / max(1, config.STT_CPU_WORKERS)
+    return max(1, min(config.STT_CPU_BATCH, int(share * 0.5 // per_chunk)))
+
+def transcribe_via_file(model, chunk, sr):
+    # Запасной путь для моделей без батчевого API
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+        tmp_path = f.name
+    try:
+        sf.write(tmp_path, chunk, sr)
+        return model.transcribe(tmp_path)
+    finally:
+        try: os.remove(tmp_path)
+        except OSError: pass
+
+def transcribe_batch(model, chunks, sr):
+    asr = get_asr(model)
+    if asr is None:
+        return [transcribe_via_file(model, c, sr) for c in chunks]
+
+    param = next(asr.parameters())
+    lengths = torch.tensor([len(c) for c in chunks], dtype=torch.long)
+    wav = torch.zeros(len(chunks), int(lengths.max()), dtype=torch.float32)
+    for j, c in enumerate(chunks):
+        wav[j, :len(c)] = torch.from_numpy(c)
+    wav = wav.to(param.device, dtype=param.dtype, non_blocking=True)
+    lengths = lengths.to(param.device)
+
+    with torch.inference_mode():
+        encoded, encoded_len = asr.forward(wav, lengths)
+        results = asr.decoding.decode(asr.head, encoded, encoded_len)
+    # decode может вернуть строки или кортежи (текст, ...)
+    return [r if isinstance(r, str) else r[0] for r in results]
+
+def run_batch(model, chunks, sr):
+    # При нехватке VRAM делим батч пополам, а не теряем куски
+    try:
+        return transcribe_batch(model, chunks, sr)
+    except torch.cuda.OutOfMemoryError:
+        if len(chunks) == 1: raise
+        torch.cuda.empty_cache()
+        half = len(chunks) // 2
+        return run_batch(model, chunks[:half], sr) + run_batch(model, chunks[half:], sr)
+
+def chunk_fingerprint(file_path):
+    # Чекпоинт годится, только если не менялись ни аудио, ни модель, ни нарезка
+    st = os.stat(file_path)
+    settings = [config.MODEL_ID, config.MODEL_REVISION, config.STT_BACKEND, config.CHUNK_MODE, st.st_size, st.st_mtime]
+    if config.CHUNK_MODE == "vad":
+        settings += [getattr(config, name) for name in sorted(dir(config)) if name.startswith("VAD_")]
     else:
-        return text1 + " " + text2
+        settings += [CHUNK_DURATION, OVERLAP]
+    return hashlib.md5(json.dumps(settings).encode('utf-8')).hexdigest()
 
-def transcribe_file_native(file_path, model, temp_root, pbar_main=None):
-    data, sr = sf.read(str(file_path))
-    if len(data.shape) > 1: data = data[:, 0]
-    
-    total_samples = len(data)
-    chunk_samples = int(CHUNK_DURATION * sr)
-    overlap_samples = int(OVERLAP * sr)
-    step = chunk_samples - overlap_samples
-    
-    file_hash = hashlib.md5(str(file_path).encode('utf-8')).hexdigest()
-    file_temp_dir = temp_root / file_hash
-    
-    if file_temp_dir.exists(): shutil.rmtree(file_temp_dir, ignore_errors=True)
-    file_temp_dir.mkdir(parents=True, exist_ok=True)
+def run_and_checkpoint(model, batch, sr, file_path, fingerprint):
+    # batch: [(start, stop, chunk)]; возвращает [(start, stop, text)] для удачных кусков
+    try:
+        texts = run_batch(model, [chunk for _, _, chunk in batch], sr)
+        results = [(start, stop, text) for (start, stop, _), text in zip(batch, texts)]
+    except Exception:
+        # Батч упал — пробуем по одному, чтобы один битый кусок не тянул за собой остальные
+        results = []
+        for start, stop, chunk in batch:
+            try:
+                results.append((start, stop, run_batch(model, [chunk], sr)[0]))
+            except Exception as e:
+                manifest.fail_chunks(file_path, fingerprint, [(start, stop)], e)
+    manifest.save_chunks(file_path, fingerprint, results)
+    return results
+
+def transcribe_file_native(file_path, model, pbar_main=None, batch_size=None):
+    # Файл не грузится целиком: .s16 открывается через memmap, wav/flac читаются блоками.
+    # Куски собираются в батчи прямо в памяти, без временных WAV.
+    # Текст каждого куска сразу пишется в манифест: после падения распознаются только недостающие.
+    audio, sr = audio_io.open_audio(file_path)
 
     try:
-        chunks_info = []
-        for i in range(0, total_samples, step):
-            if total_samples - i < sr: break
-            
-            end = min(i + chunk_samples, total_samples)
-            chunk_data = data[i:end]
-            
-            chunk_name = f"{i}.wav"
-            chunk_path = file_temp_dir / chunk_name
-            sf.write(str(chunk_path), chunk_data, sr)
-            chunks_info.append(str(chunk_path))
-
-        full_text = ""
-        
+        fingerprint = chunk_fingerprint(file_path)
+        done = manifest.load_chunks(file_path, fingerprint)
+        spans = chunk_spans(audio, sr)
+        todo = [span for span in spans if span not in done]
+        batch_size = batch_size or auto_batch_size(int(max(CHUNK_DURATION, config.VAD_MAX_CHUNK) * sr), sr)
+
         if pbar_main:
-            pbar_main.set_description(f"Processing ({len(chunks_info)} chunks)")
-        
-        for chunk_path in chunks_info:
+            resumed = f", resumed {len(spans) - len(todo)}" if len(todo) < len(spans) else ""
+            pbar_main.set_description(f"Processing ({len(spans)} chunks{resumed}, batch {batch_size})")
+
+        # Окна читаются потоково, в памяти не больше batch_size кусков независимо от длины записи
+        windows = audio_io.iter_chunks(audio, todo)
+        while True:
+            batch = list(itertools.islice(windows, batch_size))
+            if not batch: break
+            for start, stop, text in run_and_checkpoint(model, batch, sr, file_path, fingerprint):
+                done[(start, stop)] = text
+
+        missing = sum(1 for span in spans if span not in done)
+        if missing:
+            raise RuntimeError(f"не распознано кусков: {missing} из {len(spans)}, повтор при следующем запуске")
+
+        # Куски VAD не перекрываются, фиксированные окна склеиваются по общим словам
+        return transcript.assemble([done[span] for span in spans], overlapping=config.CHUNK_MODE != "vad")
+
+    finally:
+        audio_io.close_audio(audio)
+
+def load_asr_model():
+    print("Loading model...")
+    model = AutoModel.from_pretrained(
+        config.MODEL_ID, 
+        revision=config.MODEL_REVISION, 
+        trust_remote_code=True
+    ).to(config.DEVICE)
+    model.eval()
+    model = stt_backend.apply(model, config.STT_BACKEND)
+    print(f"Model loaded ({config.STT_BACKEND}).")
+    return model
+
+def load_punct_model():
+    try:
+        from deepmultilingualpunctuation import PunctuationModel
+        punct_model = PunctuationModel(model="oliverguhr/fullstop-punctuation-multilang-large")
+        print("Punctuation model loaded.")
+    except Exception:
+        print("[WARN] deepmultilingualpunctuation failed. Skipping punctuation.")
+        punct_model = None
+    return punct_model
+
+def load_models():
+    return load_asr_model(), load_punct_model()
+
+def get_txt_path(wav_path):
+    rel_path = Path(wav_path).relative_to(config.DIR_AUDIO_WAV)
+    return config.DIR_TEXT_RAW / rel_path.with_suffix(".txt")
+
+def save_text(wav_path, raw_text, punct_model):
+    if punct_model and raw_text and len(raw_text) > 5:
+        try:
+            final_text = punctuate.restore(punct_model, raw_text)
+        except:
+            final_text = raw_text
+    else:
+        final_text = raw_text
+
+    txt_path = get_txt_path(wav_path)
+    txt_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = txt_path.with_name(txt_path.name + ".part")
+    with open(part_path, "w", encoding="utf-8") as f:
+        f.write(final_text)
+    os.replace(part_path, txt_path)
+    manifest.mark_done('stt', txt_path)
+    manifest.clear_chunks(wav_path)
+    return txt_path, final_text
+
+def transcribe_raw(wav_path, model, pbar=None):
+    manifest.mark_running('stt', get_txt_path(wav_path))
+    return transcribe_file_native(wav_path, model, pbar)
+
+def transcribe_one(wav_path, model, punct_model, pbar=None):
+    return save_text(wav_path, transcribe_raw(wav_path, model, pbar), punct_model)
+
+def start_punct_worker(punct_model):
+    # Пунктуация и запись текста идут в фоне: распознавание следующего файла ее не ждет
+    texts_q = queue.Queue(maxsize=config.PUNCT_QUEUE_SIZE)
+
+    def worker():
+        while True:
+            item = texts_q.get()
+            if item is None: break
+            wav_path, raw_text = item
             try:
-                text_part = model.transcribe(chunk_path)
-                
-                full_text = smart_merge(full_text, text_part)
-                
+                save_text(wav_path, raw_text, punct_model)
             except Exception as e:
-                pass
+                print(f"\n[ERR] {Path(wav_path).name}: {e}")
+                manifest.mark_failed('stt', get_txt_path(wav_path), e)
 
-        return full_text
+    thread = threading.Thread(target=worker, name="punctuation", daemon=True)
+    thread.start()
+    return texts_q, thread
 
-    finally:
-        if file_temp_dir.exists(): 
-            try: shutil.rmtree(file_temp_dir, ignore_errors=True)
-            except: pass
+
+def fan_out_duplicates(duplicates):
+    # Текст каноничной записи раздается ее акустическим дублям
+    for wav_path, dups in duplicates.items():
+        txt_path = get_txt_path(wav_path)
+        if dups and manifest.is_done('stt', txt_path):
+            manifest.fan_out('stt', txt_path, [get_txt_path(d) for d in dups])
+
+
+# --- CPU: несколько процессов, в каждом своя модель и своя доля ядер ---
+
+def cpu_worker_count(requested):
+    if requested: return requested
+    # Мелкие CTC-куски плохо масштабируются по intra-op потокам: лучше больше процессов по 4 ядра
+    return max(1, (os.cpu_count() or 1) // 4)
+
+def cpu_worker(task_q, result_q, threads, settings):
+    # Процесс запускается через spawn: настройки из CLI главного процесса передаются явно
+    for name, value in settings.items(): setattr(config, name, value)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    try:
+        model = load_asr_model()
+    except Exception as e:
+        result_q.put(('fatal', None, str(e)))
+        return
+
+    while True:
+        wav_path = task_q.get()
+        if wav_path is None: break
+        try:
+            result_q.put(('ok', wav_path, transcribe_file_native(Path(wav_path), model)))
+        except Exception as e:
+            result_q.put(('err', wav_path, str(e)))
+
+def run_cpu_pool(files, workers, punct_model):
+    ctx = multiprocessing.get_context("spawn")
+    task_q, result_q = ctx.Queue(), ctx.Queue()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    settings = {name: getattr(config, name) for name in ('DEVICE', 'STT_BACKEND', 'STT_BATCH_SIZE', 'STT_CPU_BATCH', 'CHUNK_MODE')}
+    settings['STT_CPU_WORKERS'] = workers  # чтобы каждый процесс брал свою долю RAM под батч
+    print(f"CPU workers: {workers} x {threads} threads")
+
+    for wav_path in files:
+        manifest.mark_running('stt', get_txt_path(wav_path))
+        task_q.put(str(wav_path))
+    procs = [ctx.Process(target=cpu_worker, args=(task_q, result_q, threads, settings), daemon=True) for _ in range(workers)]
+    for p in procs:
+        task_q.put(None)
+        p.start()
+
+    # Воркеры только распознают; пунктуация, запись и манифест — в фоновом потоке главного процесса
+    texts_q, punct_thread = start_punct_worker(punct_model)
+    pbar = tqdm(total=len(files), unit="file")
+    pending = len(files)
+    while pending:
+        try:
+            status, wav_path, payload = result_q.get(timeout=5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in procs):
+                print("\n[ERR] Все CPU-воркеры завершились")
+                break
+            continue
+
+        if status == 'fatal':
+            print(f"\n[ERR] Воркер не загрузил модель: {payload}")
+            continue
+        pending -= 1
+        pbar.update(1)
+        if status == 'ok':
+            texts_q.put((wav_path, payload))
+        else:
+            print(f"\n[ERR] {Path(wav_path).name}: {payload}")
+            manifest.mark_failed('stt', get_txt_path(wav_path), payload)
+    pbar.close()
+
+    texts_q.put(None)
+    punct_thread.join()
+
+    for p in procs: p.join(timeout=5)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--test", action="store_true", help="Process 1 file and exit")
     parser.add_argument("--clean-cache", action="store_true", help="Clean HF cache")
+    parser.add_argument("--batch-size", type=int, default=config.STT_BATCH_SIZE, help="Chunks per forward pass (0 = auto)")
+    parser.add_argument("--cpu-workers", type=int, default=config.STT_CPU_WORKERS, help="Processes for DEVICE=cpu (0 = cores // 4)")
+    parser.add_argument("--backend", choices=stt_backend.BACKENDS, default=config.STT_BACKEND, help="Inference backend (int8/onnx: CPU only)")
+    parser.add_argument("--chunk-mode", choices=["vad", "fixed"], default=config.CHUNK_MODE, help="VAD chunks at pauses or fixed overlapping windows")
+    schedule.add_filter_args(parser)
     args = parser.parse_args()
 
     if args.clean_cache:
@@ -111,43 +363,39 @@ def main():
     print(f"--- GigaAM-v3 Native Transcriber ---")
     print(f"Device: {config.DEVICE}")
     print(f"Model Revision: {config.MODEL_REVISION}")
+    config.STT_BATCH_SIZE = args.batch_size
+    config.CHUNK_MODE = args.chunk_mode
+    config.STT_BACKEND = args.backend
+    print(f"Chunking: {config.CHUNK_MODE}")
 
-    try:
-        print("Loading model...")
-        model = AutoModel.from_pretrained(
-            config.MODEL_ID, 
-            revision=config.MODEL_REVISION, 
-            trust_remote_code=True
-        ).to(config.DEVICE)
-        model.eval()
-        print("Model loaded.")
+    manifest.ensure_synced()
+    files_to_process = [Path(row['input_path']) for row in manifest.plan('stt', topic_ids=schedule.selected_topic_ids(args))]
+    
+    print(f"Files to process: {len(files_to_process)}")
+
+    # Одинаковые по звуку записи (склеенные лекции, перекодированные копии) распознаются один раз
+    duplicates = {}
+    if config.STT_DEDUP and not args.test and len(files_to_process) > 1:
+        duplicates = acoustic.group_duplicates(files_to_process)
+        files_to_process = list(duplicates)
+        n_dups = sum(len(dups) for dups in duplicates.values())
+        if n_dups: print(f"Acoustic duplicates: {n_dups} (one transcription per group)")
 
+    cpu_workers = cpu_worker_count(args.cpu_workers)
+    if config.DEVICE == "cpu" and cpu_workers > 1 and not args.test and len(files_to_process) > 1:
+        run_cpu_pool(files_to_process, min(cpu_workers, len(files_to_process)), load_punct_model())
+        fan_out_duplicates(duplicates)
+        print("\nDone.")
+        return
+
+    try:
+        model, punct_model = load_models()
     except Exception as e:
         print(f"CRITICAL Error loading components: {e}")
         return
-    
-    try:
-        from deepmultilingualpunctuation import PunctuationModel
-        punct_model = PunctuationModel(model="oliverguhr/fullstop-punctuation-multilang-large")
-        print("Punctuation model loaded.")
-    except Exception:
-        print("[WARN] deepmultilingualpunctuation failed. Skipping punctuation.")
-        punct_model = None
-
-    TEMP_CHUNKS_DIR = config.BASE_DIR / 'temp_chunks'
-    if not TEMP_CHUNKS_DIR.exists(): TEMP_CHUNKS_DIR.mkdir()
-
-    all_files = get_audio_files(config.DIR_AUDIO_WAV)
-    files_to_process = []
-    for wav_path in all_files:
-        rel_path = wav_path.relative_to(config.DIR_AUDIO_WAV)
-        txt_path = config.DIR_TEXT_RAW / rel_path.with_suffix(".txt")
-        if not txt_path.exists():
-            files_to_process.append(wav_path)
-    
-    print(f"Files to process: {len(files_to_process)}")
 
     pbar = tqdm(files_to_process, unit="file")
+    texts_q, punct_thread = start_punct_worker(punct_model)
     
     for wav_path in pbar:
         short_name = wav_path.name 
@@ -155,35 +403,22 @@ def main():
         pbar.set_postfix_str(short_name)
         
         try:
-            rel_path = wav_path.relative_to(config.DIR_AUDIO_WAV)
-            txt_path = config.DIR_TEXT_RAW / rel_path.with_suffix(".txt")
-            
-            raw_text = transcribe_file_native(wav_path, model, TEMP_CHUNKS_DIR, pbar)
-                        
-            if punct_model and raw_text and len(raw_text) > 5:
-                try:
-                    final_text = punct_model.restore_punctuation(raw_text)
-                except:
-                    final_text = raw_text
-            else:
-                final_text = raw_text
-            
-            txt_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(final_text)
-
             if args.test:
+                txt_path, final_text = transcribe_one(wav_path, model, punct_model, pbar)
                 print(f"\n[TEST MODE] Output saved to: {txt_path}")
                 print(f"Sample: {final_text[:300]}...")
                 break
+
+            texts_q.put((wav_path, transcribe_raw(wav_path, model, pbar)))
                 
         except Exception as e:
             print(f"\n[ERR] {wav_path.name}: {e}")
+            manifest.mark_failed('stt', get_txt_path(wav_path), e)
             continue
 
-    if TEMP_CHUNKS_DIR.exists():
-        try: shutil.rmtree(TEMP_CHUNKS_DIR, ignore_errors=True)
-        except: pass
+    texts_q.put(None)
+    punct_thread.join()
+    fan_out_duplicates(duplicates)
 
     print("\nDone.")
 
@@ -1,49 +1,114 @@
 import os
 import time
+import random
+import asyncio
 import argparse
 import hashlib
 import json
 from collections import defaultdict
 from pathlib import Path
 from tqdm import tqdm
-from google import genai
-from google.genai import types
 import config
+import manifest
+import edit_plan
+import edit_cache
+import edit_backend
+import schedule
 
-TPM_LIMIT = 125000
+TPM_LIMIT = config.EDITOR_TPM_LIMIT
+TOKEN_CACHE_PATH = config.DIR_CACHE / 'token_counts.json'
 
-def get_file_hash(filepath):
-    hash_md5 = hashlib.md5()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+class RateLimiter:
+    # Два токен-бакета на минуту: токены (TPM) и запросы (RPM). Бакет пополняется
+    # непрерывно, запрос ждет ровно столько, сколько нужно до нужного уровня.
+    def __init__(self, tpm, rpm):
+        self.capacity = {'tokens': float(tpm), 'requests': float(rpm)}
+        self.level = dict(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
 
-def get_txt_files(directory):
-    return list(directory.rglob("*.txt"))
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        for name, cap in self.capacity.items():
+            self.level[name] = min(cap, self.level[name] + cap * elapsed / 60)
 
-def process_batch(client, batch_data):
+    async def acquire(self, tokens):
+        need = {'tokens': min(float(tokens), self.capacity['tokens']), 'requests': 1.0}
+        async with self.lock:
+            while True:
+                self._refill()
+                wait = max((need[name] - self.level[name]) / self.capacity[name] * 60 for name in need)
+                if wait <= 0:
+                    for name in need: self.level[name] -= need[name]
+                    return
+                await asyncio.sleep(wait)
+
+    def drain(self):
+        # 429 от API: квота уже выбрана кем-то еще, начинаем копить с нуля
+        self._refill()
+        for name in self.level: self.level[name] = 0.0
+
+def build_prompt(batch_data):
     request_json_str = json.dumps(batch_data, ensure_ascii=False, indent=2)
-    full_prompt_text = f"{config.EDITOR_PROMPT}\n\nJSON_INPUT:\n{request_json_str}"
+    return f"{config.EDITOR_PROMPT}\n\nJSON_INPUT:\n{request_json_str}"
 
+def make_token_counter(client):
+    # Точный подсчет через бэкенд с кэшем по хешу текста; без клиента или при ошибке — оценка
+    if not (config.EDITOR_COUNT_TOKENS and client):
+        return edit_plan.estimate_tokens
     try:
-        response = client.models.generate_content(
-            model=config.EDITOR_MODEL,
-            contents=full_prompt_text,
-            config={
-                "response_mime_type": "application/json",
-                "temperature": 0.3,
-                "top_p": 0.95
-            }
-        )
-        return json.loads(response.text)
-
-    except (json.JSONDecodeError, AttributeError, ValueError) as e:
-        print(f"\n[ERR] Failed to parse JSON response: {e}")
-        return {}
-    except Exception as e:
-        print(f"\n[ERR] API call failed: {e}")
-        return {}
+        cache = json.loads(TOKEN_CACHE_PATH.read_text('utf-8'))
+    except (OSError, ValueError):
+        cache = {}
+
+    def count(text):
+        key = hashlib.md5(f"{client.name}:{client.model}:{text}".encode('utf-8')).hexdigest()
+        if key not in cache:
+            try:
+                cache[key] = client.count_tokens(text)
+            except Exception:
+                return edit_plan.estimate_tokens(text)
+            TOKEN_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            TOKEN_CACHE_PATH.write_text(json.dumps(cache), encoding='utf-8')
+        return cache[key]
+    return count
+
+def is_retryable(e):
+    code = getattr(e, 'code', None) or getattr(e, 'status_code', None)
+    text = str(e)
+    if isinstance(e, TimeoutError): return True
+    return code in (429, 500, 502, 503, 504) or '429' in text or 'RESOURCE_EXHAUSTED' in text or 'UNAVAILABLE' in text
+
+async def process_batch(client, limiter, batch_data):
+    full_prompt_text = build_prompt(batch_data)
+    input_tokens = sum(edit_plan.estimate_tokens(text) for text in batch_data.values())
+    tokens = edit_plan.request_tokens(edit_plan.estimate_tokens(full_prompt_text) - input_tokens, input_tokens)
+
+    for attempt in range(config.EDITOR_MAX_RETRIES + 1):
+        if limiter: await limiter.acquire(tokens)
+        try:
+            response_text = await client.generate(full_prompt_text)
+            return json.loads(response_text)
+
+        except (json.JSONDecodeError, AttributeError, ValueError, TypeError, KeyError, IndexError) as e:
+            print(f"\n[ERR] Failed to parse JSON response: {e}")
+            return {}
+        except Exception as e:
+            if not is_retryable(e) or attempt == config.EDITOR_MAX_RETRIES:
+                print(f"\n[ERR] API call failed: {e}")
+                return {}
+            if limiter and ('429' in str(e) or 'RESOURCE_EXHAUSTED' in str(e)): limiter.drain()
+            # Экспоненциальная пауза с джиттером, чтобы параллельные запросы не били в API разом
+            await asyncio.sleep(config.EDITOR_BACKOFF_BASE * 2 ** attempt * random.uniform(0.8, 1.2))
+    return {}
+
+def make_client():
+    client = edit_backend.make_backend()
+    # Лимитер живет столько же, сколько клиент: квота учитывается и между вызовами run_batches
+    # (pipeline отправляет батчи по мере готовности текстов)
+    client.limiter = RateLimiter(TPM_LIMIT, config.EDITOR_RPM) if client.rate_limited else None
+    return client
 
 def create_metadata_header(file_paths):
     sorted_paths = sorted(file_paths, key=lambda x: x.name)
@@ -53,87 +118,190 @@ def create_metadata_header(file_paths):
     header += "\n" + "="*65 + "\n\n"
     return header
 
+def group_files(files):
+    files_by_hash = defaultdict(list)
+    for f in files:
+        files_by_hash[manifest.content_hash('stt', f)].append(f)
+    return list(files_by_hash.values())
+
+def own_clean_path(raw_path):
+    # Путь, по которому манифест ищет результат этой лекции (для MERGED-групп — без префикса)
+    return config.DIR_TEXT_CLEAN / raw_path.relative_to(config.DIR_TEXT_RAW)
+
+def is_current(group_meta):
+    # Результат этой группы уже есть, файл не менялся и сделан позже каждого входного текста
+    clean_path = get_clean_path(group_meta)
+    for p in group_meta:
+        own_path = own_clean_path(p)
+        row = manifest.get_artifact('clean', own_path)
+        if not manifest.is_done('clean', own_path) or row['path'] != str(clean_path):
+            return False
+        if row['mtime'] < p.stat().st_mtime:
+            return False
+    return True
+
+def stale_groups(groups, force=False):
+    return list(groups) if force else [g for g in groups if not is_current(g)]
+
+def build_items(groups, client):
+    count_tokens = make_token_counter(client)
+    capacity = edit_backend.input_capacity(client, count_tokens(config.EDITOR_PROMPT))
+    return edit_plan.plan_items(groups, count_tokens, capacity, min(config.EDITOR_SPLIT_TOKENS, capacity))
+
+def cache_key(client, text):
+    # Все, от чего зависит ответ: промпт, бэкенд и модель, параметры генерации и сам текст
+    return edit_cache.make_key(config.EDITOR_PROMPT, client.name, client.model, client.params, text)
+
+def batch_capacity(client):
+    return edit_backend.input_capacity(client, edit_plan.estimate_tokens(config.EDITOR_PROMPT))
+
+def get_clean_path(group_meta):
+    primary_file = group_meta[0]
+    fname = f"MERGED_{primary_file.name}" if len(group_meta) > 1 else primary_file.name
+    return config.DIR_TEXT_CLEAN / primary_file.relative_to(config.DIR_TEXT_RAW).parent / fname
+
+def save_result(group_meta, cleaned_text):
+    clean_path = get_clean_path(group_meta)
+    header = create_metadata_header(group_meta)
+    content = header + str(cleaned_text)
+
+    clean_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = clean_path.with_name(clean_path.name + ".part")
+    part_path.write_text(content, encoding='utf-8')
+    os.replace(part_path, clean_path)
+
+    topic_ids = [tid for tid in (manifest.topic_id_of('stt', p) for p in group_meta) if tid is not None]
+    manifest.mark_done('clean', clean_path, topic_ids=topic_ids)
+    return clean_path
+
+async def run_batches_async(client, items, on_saved=None, use_cache=True):
+    counts = {'processed': 0, 'failed': 0, 'cached': 0}
+    limiter = client.limiter
+    in_flight = asyncio.Semaphore(client.concurrency)
+
+    parts = defaultdict(dict)  # group_id -> {номер окна: текст}; окна одной лекции могут быть в разных батчах
+
+    def collect(item, cleaned_text):
+        if item['part'] is None:
+            return cleaned_text
+        group_id, k, n = item['part']
+        parts[group_id][k] = cleaned_text
+        if len(parts[group_id]) < n:
+            return None
+        pieces = parts.pop(group_id)
+        return edit_plan.stitch([pieces[i] for i in range(n)], config.EDITOR_SPLIT_OVERLAP_WORDS)
+
+    def finish(item, cleaned_text):
+        text = collect(item, cleaned_text)
+        if text is None: return
+        save_result(item['group_meta'], text)
+        counts['processed'] += 1
+        if on_saved: on_saved(item['group_meta'])
+
+    async def handle(batch, missing):
+        batch_to_send = {item_id: data['text'] for item_id, data in batch.items()}
+        async with in_flight:
+            cleaned_results = await process_batch(client, limiter, batch_to_send)
+
+        received = []
+        for item_id, item in batch.items():
+            cleaned_text = cleaned_results.get(item_id)
+            # Ключ, которого нет в ответе (или пустой текст), уходит в следующий раунд
+            if not isinstance(cleaned_text, str) or not cleaned_text.strip():
+                missing[item_id] = item
+                continue
+            received.append((cache_key(client, item['text']), cleaned_text))
+            finish(item, cleaned_text)
+        if config.EDITOR_CACHE: edit_cache.put_many(received)
+
+    # Сначала кэш: в батчи идут только элементы, которых в нем нет
+    missing = {}
+    for item_id, item in items.items():
+        cleaned_text = edit_cache.get(cache_key(client, item['text'])) if config.EDITOR_CACHE and use_cache else None
+        if cleaned_text is None:
+            missing[item_id] = item
+            continue
+        counts['cached'] += 1
+        finish(item, cleaned_text)
+    if counts['cached']:
+        print(f"From cache: {counts['cached']} items, to send: {len(missing)}")
+
+    # Несколько запросов одновременно; темп задает лимитер (или число слотов локального сервера)
+    start_t, start_tokens = time.perf_counter(), client.output_tokens
+    for round_no in range(config.EDITOR_REQUEUE_ROUNDS + 1):
+        if not missing: break
+        if round_no:
+            print(f"\nRe-queue {len(missing)} items missing from responses (round {round_no})")
+        if client.per_item:
+            batches = [{item_id: item} for item_id, item in missing.items()]
+        else:
+            batches = edit_plan.pack_items(missing, batch_capacity(client))
+        missing = {}
+        tasks = [asyncio.create_task(handle(batch, missing)) for batch in batches]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing Batches"):
+            await task
+
+    # Что не вернулось и после повторов — в манифест как failed, а не молча пропадает
+    failed_groups = {id(item['group_meta']): item['group_meta'] for item in missing.values()}
+    for group_meta in failed_groups.values():
+        for p in group_meta:
+            manifest.mark_failed('clean', own_clean_path(p), "missing from editor response")
+        print(f"[ERR] Not edited: {group_meta[0].name}")
+    counts['failed'] = len(failed_groups)
+
+    elapsed, generated = time.perf_counter() - start_t, client.output_tokens - start_tokens
+    if generated:
+        print(f"Generated {generated} tokens in {elapsed:.0f}s ({generated / elapsed:.1f} tok/s)")
+
+    return counts['processed'], counts['failed']
+
+def run_batches(client, items, on_saved=None, use_cache=True, loop=None):
+    # Долгоживущий клиент (pipeline) держит соединения, привязанные к своему event loop:
+    # такой вызывающий передает свой loop, чтобы все прогоны шли в одном
+    coro = run_batches_async(client, items, on_saved, use_cache)
+    return loop.run_until_complete(coro) if loop else asyncio.run(coro)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--force", action="store_true")
+    parser.add_argument("--backend", choices=edit_backend.BACKENDS, help="Переопределить config.EDITOR_BACKEND")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="Не брать ответы из кэша (новые все равно сохраняются)")
+    schedule.add_filter_args(parser)
     args = parser.parse_args()
+    if args.backend: config.EDITOR_BACKEND = args.backend
 
-    if not config.GOOGLE_API_KEY:
-        print("ERROR: NO API KEY")
+    error = edit_backend.missing_credentials()
+    if error:
+        print(f"ERROR: {error}")
         return
 
-    client = genai.Client(api_key=config.GOOGLE_API_KEY)
+    client = make_client()
     if not config.DIR_TEXT_CLEAN.exists():
         config.DIR_TEXT_CLEAN.mkdir(parents=True)
 
-    all_files = get_txt_files(config.DIR_TEXT_RAW)
-    print(f"--- Editor: {config.EDITOR_MODEL} (JSON Batch Mode) ---")
-    
+    mode = "per-item requests" if client.per_item else "JSON Batch Mode"
+    print(f"--- Editor: {client.model} via {client.name} ({mode}) ---")
+    manifest.ensure_synced()
+
+    # Хеши текстов уже лежат в манифесте — повторно файлы не читаем. Берем все готовые тексты:
+    # что из них устарело или не сделано, решается по каждой группе в stale_groups
     files_by_hash = defaultdict(list)
-    for f in all_files:
-        files_by_hash[get_file_hash(f)].append(f)
+    for row in manifest.plan('clean', topic_ids=schedule.selected_topic_ids(args), force=True):
+        files_by_hash[row['input_hash']].append(Path(row['input_path']))
     unique_groups = list(files_by_hash.values())
-    print(f"Unique groups to process: {len(unique_groups)}")
-    
-    batches = []
-    current_batch = {}
-    current_batch_len = 0
-
-    for group in unique_groups:
-        primary_file = group[0]
-        text = primary_file.read_text('utf-8')
-        item_id = hashlib.md5(str(group).encode()).hexdigest()
-        
-        if current_batch_len + len(text) > TPM_LIMIT and current_batch:
-            batches.append(current_batch)
-            current_batch, current_batch_len = {}, 0
-            
-        current_batch[item_id] = {'text': text, 'group_meta': group}
-        current_batch_len += len(text)
-    
-    if current_batch:
-        batches.append(current_batch)
-
-    print(f"Total batches to process: {len(batches)}")
-    
-    processed_count, skipped_count = 0, 0
-    
-    with client:
-        pbar = tqdm(batches, desc="Processing Batches")
-        for batch in pbar:
-            first_item_meta = list(batch.values())[0]['group_meta']
-            primary_file = first_item_meta[0]
-            fname = f"MERGED_{primary_file.name}" if len(first_item_meta) > 1 else primary_file.name
-            path = config.DIR_TEXT_CLEAN / primary_file.relative_to(config.DIR_TEXT_RAW).parent / fname
-            
-            if path.exists() and not args.force:
-                skipped_count += len(batch)
-                continue
-                
-            batch_to_send = {item_id: data['text'] for item_id, data in batch.items()}
-            cleaned_results = process_batch(client, batch_to_send)
-            
-            for item_id, cleaned_text in cleaned_results.items():
-                if item_id in batch:
-                    group_meta = batch[item_id]['group_meta']
-                    primary_file = group_meta[0]
-                    
-                    fname = f"MERGED_{primary_file.name}" if len(group_meta) > 1 else primary_file.name
-                    relative_path = primary_file.relative_to(config.DIR_TEXT_RAW).parent
-                    clean_dir = config.DIR_TEXT_CLEAN / relative_path
-                    clean_path = clean_dir / fname
-
-                    header = create_metadata_header(group_meta)
-                    content = header + str(cleaned_text)
-
-                    clean_dir.mkdir(parents=True, exist_ok=True)
-                    clean_path.write_text(content, encoding='utf-8')
-                    processed_count += 1
-            
-            if len(batches) > 1:
-                time.sleep(15)
-
-    print(f"\nDone. Processed: {processed_count}, Skipped: {skipped_count}")
+    groups = stale_groups(unique_groups, args.force)
+    skipped_count = len(unique_groups) - len(groups)
+    print(f"Unique groups to process: {len(groups)} (up to date: {skipped_count})")
+
+    items = build_items(groups, client)
+    print(f"Items to edit: {len(items)}")
+
+    try:
+        processed_count, failed_count = run_batches(client, items, use_cache=args.cache)
+    finally:
+        client.close()
+
+    print(f"\nDone. Processed: {processed_count}, Skipped: {skipped_count}, Failed: {failed_count}")
 
 if __name__ == "__main__":
     main()
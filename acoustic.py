@@ -0,0 +1,68 @@
+import numpy as np
+import config
+import audio_io
+
+# Дешевый акустический отпечаток записи: знаки изменения энергии по полосам спектра
+# (в духе Haitsma-Kalker) для начала, середины и конца файла + длительность.
+# Разные по байтам, но одинаковые по звуку WAV (перекодирование, повторное извлечение)
+# дают почти одинаковые биты.
+
+FRAME_SEC = 0.1
+BANDS = 17
+LOW_HZ, HIGH_HZ = 300, 4000
+
+
+def _spectral_bits(x, sr):
+    frame = int(FRAME_SEC * sr)
+    n = len(x) // frame
+    if n < 3: return np.zeros(0, dtype=bool)
+
+    frames = x[:n * frame].reshape(n, frame) * np.hanning(frame)
+    spec = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frame, 1 / sr)
+    idx = np.searchsorted(freqs, np.geomspace(LOW_HZ, HIGH_HZ, BANDS + 1))
+    bands = np.log(np.stack([spec[:, lo:hi].sum(axis=1) for lo, hi in zip(idx[:-1], idx[1:])], axis=1) + 1e-10)
+
+    # Бит = рост разности соседних полос от кадра к кадру; громкость и кодек на него почти не влияют
+    d = np.diff(bands, axis=1)
+    return (d[1:] - d[:-1] > 0).ravel()
+
+def fingerprint(path):
+    audio, sr = audio_io.open_audio(path)
+    try:
+        total = audio_io.num_samples(audio)
+        n = min(total, int(config.STT_DEDUP_SECONDS * sr))
+        mid = max(0, (total - n) // 2)
+        parts = [audio_io.read_chunk(audio, start, start + n) for start in (0, mid, total - n)]
+        return total / sr, np.concatenate([_spectral_bits(p, sr) for p in parts])
+    finally:
+        audio_io.close_audio(audio)
+
+def same_audio(fp1, fp2):
+    (dur1, bits1), (dur2, bits2) = fp1, fp2
+    if abs(dur1 - dur2) > config.STT_DEDUP_DURATION_TOL: return False
+    if len(bits1) == 0 or len(bits1) != len(bits2): return False
+    return np.mean(bits1 != bits2) <= config.STT_DEDUP_MAX_DIFF
+
+def group_duplicates(paths):
+    # {каноничный файл: [акустические дубли]}; каноничный — первый по порядку
+    fps = {}
+    for path in paths:
+        try:
+            fps[path] = fingerprint(path)
+        except Exception as e:
+            print(f"[WARN] Отпечаток не посчитан для {path}: {e}")
+
+    groups = {}
+    canon = []
+    for path in paths:
+        fp = fps.get(path)
+        owner = None
+        if fp is not None:
+            owner = next((c for c in canon if same_audio(fps[c], fp)), None)
+        if owner is None:
+            groups[path] = []
+            if fp is not None: canon.append(path)
+        else:
+            groups[owner].append(path)
+    return groups
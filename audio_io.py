@@ -0,0 +1,86 @@
+import os
+import json
+from pathlib import Path
+import config
+
+SAMPLE_RATE = 16000
+
+# Формат промежуточного аудио (config.AUDIO_FORMAT):
+#   wav  — PCM 16 бит, как раньше
+#   flac — сжатие без потерь, ~2x меньше на диске
+#   s16  — сырой int16 + <файл>.json с заголовком; транскрибер читает его через memmap
+FORMATS = {
+    'wav':  ('.wav',  ["-acodec", "pcm_s16le", "-f", "wav"]),
+    'flac': ('.flac', ["-c:a", "flac", "-compression_level", "5", "-f", "flac"]),
+    's16':  ('.s16',  ["-acodec", "pcm_s16le", "-f", "s16le"]),
+}
+
+AUDIO_EXT = FORMATS[config.AUDIO_FORMAT][0]
+
+def ffmpeg_output_args(part_path):
+    return ["-ar", str(SAMPLE_RATE), "-ac", "1", *FORMATS[config.AUDIO_FORMAT][1], str(part_path)]
+
+def sidecar_path(path):
+    return Path(str(path) + ".json")
+
+def companion_files(path):
+    # Файлы, которые должны переезжать/линковаться вместе с аудио
+    sidecar = sidecar_path(path)
+    return [sidecar] if Path(path).suffix == '.s16' and sidecar.exists() else []
+
+def finalize(part_path, audio_path):
+    if Path(audio_path).suffix == '.s16':
+        header = {'sample_rate': SAMPLE_RATE, 'channels': 1, 'dtype': 'int16',
+                  'samples': os.path.getsize(part_path) // 2}
+        sidecar = sidecar_path(audio_path)
+        tmp_sidecar = Path(str(sidecar) + ".part")
+        tmp_sidecar.write_text(json.dumps(header), encoding='utf-8')
+        os.replace(tmp_sidecar, sidecar)
+    os.replace(part_path, audio_path)
+
+
+# numpy/soundfile нужны только транскриберу, поэтому импортируются лениво
+def open_audio(path):
+    path = Path(path)
+    if path.suffix == '.s16':
+        import numpy as np
+        try:
+            header = json.loads(sidecar_path(path).read_text('utf-8'))
+        except (OSError, ValueError):
+            header = {'sample_rate': SAMPLE_RATE}
+        return np.memmap(path, dtype=np.int16, mode='r'), header['sample_rate']
+
+    import soundfile as sf
+    f = sf.SoundFile(str(path))
+    return f, f.samplerate
+
+def num_samples(audio):
+    return len(audio) if hasattr(audio, 'dtype') else audio.frames
+
+def read_chunk(audio, start, stop):
+    # Отдает только [start, stop) в float32, не загружая файл целиком
+    import numpy as np
+    if hasattr(audio, 'dtype'):
+        return np.asarray(audio[start:stop], dtype=np.float32) / 32768.0
+    if audio.tell() != start: audio.seek(start)
+    data = audio.read(stop - start, dtype='float32', always_2d=True)
+    return data[:, 0]
+
+def iter_chunks(audio, spans):
+    # Последовательное чтение окон [start, stop) по возрастанию: перекрытие с прошлым окном
+    # берется из памяти, с диска дочитывается только новый хвост. В памяти — одно окно.
+    import numpy as np
+    buf, buf_start = np.empty(0, dtype=np.float32), 0
+    for start, stop in spans:
+        buf_end = buf_start + len(buf)
+        if buf_start <= start < buf_end:
+            keep = buf[start - buf_start:stop - buf_start]
+            read_from = buf_end
+        else:
+            keep, read_from = buf[:0], start
+        new = read_chunk(audio, read_from, stop) if read_from < stop else buf[:0]
+        buf, buf_start = np.concatenate([keep, new]), start
+        yield start, stop, buf
+
+def close_audio(audio):
+    if hasattr(audio, 'close'): audio.close()
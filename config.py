@@ -20,13 +20,42 @@ DIR_TEXT_CLEAN= BASE_DIR / 'output_clean'    # 4. Clean text
 DIR_CACHE     = BASE_DIR / 'cache'           # Downloads cache
 DIR_TEMP      = BASE_DIR / 'temp_raw'        # Temp files
 
+# PIPELINE (orchestrator) SETTINGS
+PIPELINE_QUEUE_SIZE = 4  # макс. элементов в очереди между этапами (backpressure)
+PIPELINE_WORKERS = {
+    'download': 2,
+    'extract': 4,
+    'transcribe': 1,  # одна модель на GPU
+    'punctuate': 1,   # модель пунктуации, параллельно с распознаванием
+    'edit': 1,
+    'evaluate': 1,
+}
+
 # 01 DOWNLOADER SETTINGS
 TARGET_M3U8_PART = 'ru.m3u8'
+M3U8_CACHE_TTL = 12 * 3600      # сек. жизни записи в cache/m3u8_cache.json
+M3U8_VALIDATE_TIMEOUT = 5       # сек. на проверку кэшированного плейлиста
+M3U8_WAIT_TIMEOUT = 25          # сек. ожидания запроса .m3u8 от плеера
+M3U8_LEAN_BROWSER = True        # блокировать картинки/шрифты/сегменты в Chrome
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 COMPRESS_VIDEO = True 
 FFMPEG_CRF = 28 
 FFMPEG_PRESET = 'veryfast'
 FFMPEG_SCALE = "-1:720"
+OUTPUT_DIR = DIR_VIDEO_RAW
+TEMP_DIR = DIR_TEMP
+FILENAME_FORMAT = "{time} - {speaker} - {title}.mp4"
+MAX_TITLE_LEN = 100
+MAX_SPEAKER_LEN = 60
+MAX_FILENAME_LENGTH = 180
+DOWNLOAD_WORKERS = 3   # параллельных загрузок yt-dlp
+COMPRESS_WORKERS = 2   # параллельных ffmpeg (ядра делятся между ними через -threads)
+SINGLE_PASS = False    # HLS -> MP4 + WAV одним ffmpeg (без temp_raw и этапа 02)
+AUDIO_ONLY = False     # только WAV из аудио-дорожки / самого легкого варианта HLS
+
+# 02 EXTRACTOR SETTINGS
+EXTRACT_WORKERS = os.cpu_count() or 4  # параллельных процессов ffmpeg
+AUDIO_FORMAT = "wav"  # "wav" | "flac" (меньше на диске) | "s16" (сырой int16 + .json, memmap в транскрибере)
 
 # 03 TRANSCRIBER SETTINGS
 MODEL_ID = "ai-sage/GigaAM-v3"
@@ -34,9 +63,56 @@ MODEL_REVISION = "ctc"
 CHUNK_DURATION = 20.0
 OVERLAP = 2.0
 DEVICE = "cuda" # или "cpu"
+STT_BATCH_SIZE = 0   # кусков в одном forward; 0 — подобрать по свободной VRAM (на CPU — RAM)
+STT_MAX_BATCH = 32   # верхняя граница авто-подбора на GPU
+STT_CPU_BATCH = 8    # верхняя граница авто-подбора на CPU (по свободной RAM)
+STT_BACKEND = "eager"       # "eager" | "int8" | "compile" | "onnx"; сравнить: python stt_backend.py
+STT_BACKEND_MAX_WER = 0.02  # допустимый WER бэкенда относительно eager fp32
+STT_CPU_WORKERS = 0  # процессов при DEVICE = "cpu", у каждого своя модель; 0 — по одному на 4 ядра
+STT_DEDUP = True               # искать одинаковые по звуку записи и распознавать группу один раз
+STT_DEDUP_SECONDS = 30         # сек. начала, середины и конца для отпечатка
+STT_DEDUP_DURATION_TOL = 1.0   # сек., допустимая разница длительности
+STT_DEDUP_MAX_DIFF = 0.15      # доля несовпавших бит отпечатка, при которой записи считаются одной
+STT_SERVER_HOST = "127.0.0.1"  # stt_server.py / stt_client.py
+STT_SERVER_PORT = 8765
+PUNCT_WINDOW_WORDS = 200  # слов в окне модели пунктуации (лимит модели — 512 токенов)
+PUNCT_OVERLAP_WORDS = 40  # перекрытие соседних окон, граница — посередине
+PUNCT_BATCH_SIZE = 8      # окон в одном батче
+PUNCT_QUEUE_SIZE = 4      # сырых текстов в очереди к фоновой пунктуации
+CHUNK_MODE = "vad"   # "vad" — куски по паузам, тишина пропускается; "fixed" — окна CHUNK_DURATION/OVERLAP
+VAD_FRAME_MS = 30        # длина кадра для оценки громкости
+VAD_MARGIN_DB = 12.0     # насколько речь громче шумового пола
+VAD_MIN_DB = -55.0       # тише этого — всегда тишина
+VAD_MIN_SPEECH = 0.3     # сек., более короткие всплески (щелчки) отбрасываются
+VAD_MIN_SILENCE = 0.4    # сек., более короткие паузы считаются частью речи
+VAD_PAD = 0.15           # сек. запаса вокруг каждой фразы
+VAD_MERGE_GAP = 1.0      # сек., фразы с паузой короче склеиваются в один кусок
+VAD_MAX_CHUNK = 20.0     # сек., максимальная длина куска для модели
 
 # 04 EDITOR SETTINGS
+EDITOR_BACKEND = os.getenv("EDITOR_BACKEND", "gemini")  # gemini | openai (llama-server и др. OpenAI-совместимые)
 EDITOR_MODEL = "gemini-2.5-flash" 
+EDITOR_TPM_LIMIT = 125000        # токенов в минуту (квота API)
+EDITOR_MAX_OUTPUT_TOKENS = 60000 # лимит ответа модели на один запрос
+EDITOR_OUTPUT_RATIO = 1.0        # ожидаемый ответ / вход в токенах
+EDITOR_SPLIT_TOKENS = 20000      # длинные тексты режутся на окна такого размера
+EDITOR_SPLIT_OVERLAP_WORDS = 40  # перекрытие окон, по нему окна склеиваются после редактуры
+EDITOR_COUNT_TOKENS = False      # точный подсчет токенов через API count_tokens (с кэшем) вместо оценки
+EDITOR_RPM = 10              # запросов в минуту (вместе с TPM_LIMIT задает темп)
+EDITOR_CONCURRENCY = 4       # запросов одновременно в полете
+EDITOR_MAX_RETRIES = 5       # повторов при 429 / 5xx
+EDITOR_BACKOFF_BASE = 2.0    # сек., первая пауза; дальше удваивается
+EDITOR_REQUEUE_ROUNDS = 2     # сколько раз повторно отправлять тексты, пропавшие из ответа
+EDITOR_CACHE = True           # кэш ответов по хешу (промпт, модель, параметры, текст)
+EDITOR_CACHE_MAX_MB = 500     # лимиты кэша; сверх них вытесняются давно не читанные ответы
+EDITOR_CACHE_MAX_ITEMS = 100000
+EDITOR_BASE_URL = os.getenv("EDITOR_BASE_URL")  # напр. http://127.0.0.1:8766 для editor_stub.py
+EDITOR_LOCAL_URL = os.getenv("EDITOR_LOCAL_URL", "http://127.0.0.1:8080/v1")  # llama-server / vLLM / Ollama
+EDITOR_LOCAL_MODEL = "gigachat3-10b-a1.8b-q5_k_m"
+EDITOR_LOCAL_API_KEY = os.getenv("EDITOR_LOCAL_API_KEY")
+EDITOR_LOCAL_PARALLEL = 8      # запросов одновременно; = --parallel у llama-server
+EDITOR_LOCAL_CONTEXT = 8192    # контекст одного слота: -c / --parallel у llama-server
+EDITOR_LOCAL_TIMEOUT = 1800    # сек. на один ответ локальной модели
 
 EDITOR_PROMPT = EDITOR_PROMPT = """
 Ты — высокопроизводительный сервис для пакетной редактуры текста, работающий в режиме JSON.
@@ -0,0 +1,103 @@
+import json
+import asyncio
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import config
+import edit_plan
+
+# Бэкенды редактора (config.EDITOR_BACKEND):
+#   gemini — Google Gemini через google-genai: большие JSON-батчи под квоту TPM/RPM
+#   openai — любой OpenAI-совместимый сервер (llama.cpp llama-server, vLLM, Ollama) на своей машине:
+#            каждый текст отдельным запросом, много запросов одновременно, чтобы continuous batching
+#            сервера держал все слоты занятыми. Квоты нет, размер запроса ограничен контекстом слота.
+# Общий интерфейс: generate(prompt) -> текст ответа, count_tokens(text), close(),
+# плюс поля, по которым 04_editor решает, как планировать запросы.
+
+BACKENDS = ['gemini', 'openai']
+
+
+class GeminiBackend:
+    name = 'gemini'
+    per_item = False       # несколько текстов в одном JSON-запросе
+    rate_limited = True    # темп задает RateLimiter (TPM/RPM)
+    context_tokens = None  # размер запроса ограничен квотой, а не контекстом
+
+    def __init__(self):
+        from google import genai
+        from google.genai import types
+        http_options = types.HttpOptions(base_url=config.EDITOR_BASE_URL) if config.EDITOR_BASE_URL else None
+        self.client = genai.Client(api_key=config.GOOGLE_API_KEY or "stub", http_options=http_options)
+        self.model = config.EDITOR_MODEL
+        self.params = {"response_mime_type": "application/json", "temperature": 0.3, "top_p": 0.95}
+        self.concurrency = config.EDITOR_CONCURRENCY
+        self.output_tokens = 0
+
+    async def generate(self, prompt):
+        response = await self.client.aio.models.generate_content(model=self.model, contents=prompt, config=self.params)
+        usage = getattr(response, 'usage_metadata', None)
+        self.output_tokens += getattr(usage, 'candidates_token_count', None) or 0
+        return response.text
+
+    def count_tokens(self, text):
+        return self.client.models.count_tokens(model=self.model, contents=text).total_tokens
+
+    def close(self):
+        self.client.close()
+
+
+class OpenAIBackend:
+    name = 'openai'
+    per_item = True
+    rate_limited = False
+
+    def __init__(self):
+        self.base_url = config.EDITOR_LOCAL_URL.rstrip('/')
+        self.model = config.EDITOR_LOCAL_MODEL
+        self.params = {"temperature": 0.3, "top_p": 0.95, "response_format": {"type": "json_object"}}
+        self.concurrency = config.EDITOR_LOCAL_PARALLEL
+        self.context_tokens = config.EDITOR_LOCAL_CONTEXT
+        self.output_tokens = 0
+        # Свой пул по числу слотов: пул asyncio по умолчанию меньше на машинах с малым числом ядер
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def _post(self, url, payload):
+        req = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'), method='POST')
+        req.add_header('Content-Type', 'application/json')
+        if config.EDITOR_LOCAL_API_KEY: req.add_header('Authorization', f"Bearer {config.EDITOR_LOCAL_API_KEY}")
+        with urllib.request.urlopen(req, timeout=config.EDITOR_LOCAL_TIMEOUT) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    async def generate(self, prompt):
+        payload = {"model": self.model, "messages": [{"role": "user", "content": prompt}], **self.params}
+        # urllib блокирующий — запросы идут из пула потоков, параллельно друг другу
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, self._post, f"{self.base_url}/chat/completions", payload)
+        self.output_tokens += (result.get('usage') or {}).get('completion_tokens') or 0
+        return result['choices'][0]['message']['content']
+
+    def count_tokens(self, text):
+        # /tokenize есть у llama-server (вне /v1); у других серверов — ошибка и оценка в make_token_counter
+        root = self.base_url[:-len('/v1')] if self.base_url.endswith('/v1') else self.base_url
+        return len(self._post(f"{root}/tokenize", {"content": text})['tokens'])
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def make_backend(name=None):
+    name = name or config.EDITOR_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown EDITOR_BACKEND '{name}', expected one of {BACKENDS}")
+    return GeminiBackend() if name == 'gemini' else OpenAIBackend()
+
+def missing_credentials(name=None):
+    # Локальному серверу ключ не нужен; Gemini — ключ или адрес заглушки
+    if (name or config.EDITOR_BACKEND) == 'gemini' and not config.GOOGLE_API_KEY and not config.EDITOR_BASE_URL:
+        return "NO API KEY"
+    return None
+
+def input_capacity(backend, prompt_tokens):
+    if backend.context_tokens is None:
+        return edit_plan.input_capacity(prompt_tokens)
+    # Весь диалог (промпт + текст + ответ) должен поместиться в контекст одного слота сервера
+    return int((backend.context_tokens - prompt_tokens) / (1 + config.EDITOR_OUTPUT_RATIO))
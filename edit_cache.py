@@ -0,0 +1,100 @@
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import config
+
+# Кэш ответов редактора по содержимому: ключ — хеш (промпт, модель, параметры, текст элемента),
+# значение — отредактированный текст. Повторный прогон с тем же входом не тратит запросов к API.
+# Размер ограничен EDITOR_CACHE_MAX_MB / EDITOR_CACHE_MAX_ITEMS, вытесняются давно не читанные записи.
+
+DB_PATH = config.DIR_CACHE / 'editor_cache.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    text       TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    created_at REAL,
+    used_at    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_used_at ON responses(used_at);
+"""
+
+_local = threading.local()
+
+def get_conn():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(DB_PATH), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get(key):
+    conn = get_conn()
+    row = conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is None: return None
+    with conn:
+        conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+    return row['text']
+
+def put_many(rows):
+    # rows: [(key, text)]
+    if not rows: return
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO responses (key, text, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+            [(key, text, len(text.encode('utf-8')), now, now) for key, text in rows]
+        )
+    evict()
+
+def evict(max_bytes=None, max_items=None):
+    # LRU: удаляем самые давно использованные записи, пока не уложимся в оба лимита
+    max_bytes = config.EDITOR_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    max_items = config.EDITOR_CACHE_MAX_ITEMS if max_items is None else max_items
+    conn = get_conn()
+    count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+    if count <= max_items and total <= max_bytes: return 0
+
+    doomed = []
+    for row in conn.execute("SELECT key, size FROM responses ORDER BY used_at"):
+        if count <= max_items and total <= max_bytes: break
+        doomed.append((row['key'],))
+        count -= 1
+        total -= row['size']
+    with conn:
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+    return len(doomed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Editor response cache (SQLite)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='Размер кэша')
+    subparsers.add_parser('clear', help='Удалить все записи')
+    args = parser.parse_args()
+
+    conn = get_conn()
+    if args.command == 'status':
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        print(f"Записей: {count}, {total / 1024 / 1024:.1f} MB "
+              f"(лимит {config.EDITOR_CACHE_MAX_ITEMS} записей / {config.EDITOR_CACHE_MAX_MB} MB)")
+    elif args.command == 'clear':
+        with conn:
+            conn.execute("DELETE FROM responses")
+        conn.execute("VACUUM")
+        print("Кэш очищен")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import re
+import hashlib
+from difflib import SequenceMatcher
+import config
+
+# Планировщик батчей редактора: оценка токенов, упаковка First-Fit Decreasing
+# под бюджет запроса, разбиение слишком длинных текстов на перекрывающиеся окна
+# и склейка отредактированных окон обратно.
+
+ITEM_OVERHEAD = 16      # токенов на ключ и кавычки одного элемента JSON
+MIN_STITCH_WORDS = 3    # меньше совпавших слов — окна просто соединяются абзацем
+
+_cyrillic_re = re.compile(r"[^\u0400-\u04FF]")
+_word_re = re.compile(r"\S+")
+_norm_re = re.compile(r"[^\w]+")
+
+
+def estimate_tokens(text):
+    # Gemini: ~3 символа кириллицы или ~4 символа латиницы/цифр на токен
+    cyrillic = len(_cyrillic_re.sub("", text))
+    return int(cyrillic / 3 + (len(text) - cyrillic) / 4) + 1
+
+def input_capacity(prompt_tokens):
+    # Сколько входных токенов помещается в один запрос: запрос целиком (промпт + вход + ответ)
+    # должен уложиться в минутную квоту, а ответ (~вход * EDITOR_OUTPUT_RATIO) — в лимит модели
+    ratio = config.EDITOR_OUTPUT_RATIO
+    by_quota = (config.EDITOR_TPM_LIMIT * 0.9 - prompt_tokens) / (1 + ratio)
+    by_output = config.EDITOR_MAX_OUTPUT_TOKENS / ratio
+    return int(min(by_quota, by_output))
+
+def request_tokens(prompt_tokens, input_tokens):
+    return int(prompt_tokens + input_tokens * (1 + config.EDITOR_OUTPUT_RATIO))
+
+def split_text(text, max_tokens, overlap_words):
+    # Окна по словам с перекрытием; конец окна по возможности сдвигается на конец предложения
+    words = text.split()
+    if not words: return [text]
+    tokens_per_word = estimate_tokens(text) / len(words)
+    size = max(overlap_words + 1, int(max_tokens / tokens_per_word))
+
+    pieces = []
+    start = 0
+    while True:
+        end = min(start + size, len(words))
+        if end < len(words):
+            lo = start + max(overlap_words + 1, int(size * 0.8))
+            sentence_end = next((i + 1 for i in range(end - 1, lo - 1, -1) if words[i].endswith(('.', '!', '?'))), None)
+            if sentence_end: end = sentence_end
+        pieces.append(" ".join(words[start:end]))
+        if end >= len(words): break
+        start = end - overlap_words
+    return pieces
+
+def _fits(batch, tokens, capacity):
+    return batch['tokens'] + tokens <= capacity
+
+def plan_items(groups, count_tokens, capacity, split_tokens):
+    # groups: [[Path, ...]] — одинаковые тексты; в запрос идет текст первого файла группы
+    items = {}
+    for group in groups:
+        text = group[0].read_text('utf-8')
+        group_id = hashlib.md5(str(group).encode()).hexdigest()
+        tokens = count_tokens(text) + ITEM_OVERHEAD
+        if tokens <= capacity:
+            items[group_id] = {'text': text, 'group_meta': group, 'part': None, 'tokens': tokens}
+            continue
+
+        pieces = split_text(text, split_tokens, config.EDITOR_SPLIT_OVERLAP_WORDS)
+        for k, piece in enumerate(pieces):
+            items[f"{group_id}_{k}"] = {'text': piece, 'group_meta': group, 'part': (group_id, k, len(pieces)),
+                                        'tokens': count_tokens(piece) + ITEM_OVERHEAD}
+    return items
+
+def pack_items(items, capacity):
+    # First-Fit Decreasing: крупные элементы первыми, каждый — в первый батч, где хватает места
+    batches = []
+    for item_id, item in sorted(items.items(), key=lambda x: -x[1]['tokens']):
+        target = next((b for b in batches if _fits(b, item['tokens'], capacity)), None)
+        if target is None:
+            target = {'items': {}, 'tokens': 0}
+            batches.append(target)
+        target['items'][item_id] = item
+        target['tokens'] += item['tokens']
+    return [b['items'] for b in batches]
+
+def _words_with_spans(text):
+    matches = list(_word_re.finditer(text))
+    return [_norm_re.sub("", m.group().lower()) for m in matches], matches
+
+def stitch(parts, overlap_words):
+    # Склейка отредактированных окон: общий фрагмент ищется по словам в хвосте одного
+    # и голове следующего окна, текст режется по позициям этих слов (абзацы сохраняются)
+    result = parts[0] if parts else ""
+    look = overlap_words * 2
+    for part in parts[1:]:
+        # Хвост берется с запасом по символам, чтобы не разбирать на слова весь текст
+        offset = max(0, len(result) - look * 40)
+        tail_norm, tail_spans = _words_with_spans(result[offset:])
+        head_norm, head_spans = _words_with_spans(part[:look * 40])
+        tail_norm, tail_spans = tail_norm[-look:], tail_spans[-look:]
+        head_norm, head_spans = head_norm[:look], head_spans[:look]
+
+        match = SequenceMatcher(None, tail_norm, head_norm, autojunk=False).find_longest_match(0, len(tail_norm), 0, len(head_norm))
+        if match.size >= MIN_STITCH_WORDS:
+            cut_result = offset + tail_spans[match.a + match.size - 1].end()
+            cut_part = head_spans[match.b + match.size - 1].end()
+            result = result[:cut_result] + part[cut_part:]
+        else:
+            result = result.rstrip() + "\n\n" + part.lstrip()
+    return result
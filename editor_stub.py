@@ -0,0 +1,110 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Локальная заглушка Gemini generate_content для проверки 04_editor.py без квоты:
+#   python editor_stub.py --rpm 10 --tpm 125000 --latency 3
+#   EDITOR_BASE_URL=http://127.0.0.1:8766 python 04_editor.py
+# Отвечает тем же JSON, что пришел в JSON_INPUT (с минимальной "редактурой"),
+# держит собственные лимиты RPM/TPM и отдает 429, как настоящий API.
+
+CHARS_PER_TOKEN = 3
+
+lock = threading.Lock()
+window = []  # (время, токены) запросов за последнюю минуту
+stats = {'ok': 0, 'rate_limited': 0, 'failed': 0, 'max_in_flight': 0, 'in_flight': 0}
+
+
+def fake_edit(text):
+    text = " ".join(str(text).split())
+    if not text: return text
+    text = text[0].upper() + text[1:]
+    return text if text.endswith(('.', '!', '?')) else text + "."
+
+def admit(tokens, rpm, tpm):
+    now = time.time()
+    with lock:
+        window[:] = [(t, n) for t, n in window if now - t < 60]
+        if len(window) + 1 > rpm or sum(n for _, n in window) + tokens > tpm:
+            stats['rate_limited'] += 1
+            return False
+        window.append((now, tokens))
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        return True
+
+
+class Handler(BaseHTTPRequestHandler):
+    def _reply(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        with lock: self._reply(200, dict(stats))
+
+    def do_POST(self):
+        if not self.path.split('?')[0].endswith(':generateContent'):
+            self._reply(404, {'error': {'code': 404, 'message': 'not found', 'status': 'NOT_FOUND'}})
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+        prompt = "".join(part.get('text', '') for c in request.get('contents', []) for part in c.get('parts', []))
+        tokens = 2 * len(prompt) // CHARS_PER_TOKEN
+
+        args = self.server.args
+        if not admit(tokens, args.rpm, args.tpm):
+            self._reply(429, {'error': {'code': 429, 'message': 'Resource has been exhausted (e.g. check quota).',
+                                        'status': 'RESOURCE_EXHAUSTED'}})
+            return
+
+        try:
+            time.sleep(args.latency * random.uniform(0.5, 1.5))
+            if random.random() < args.fail_rate:
+                with lock: stats['failed'] += 1
+                self._reply(503, {'error': {'code': 503, 'message': 'The model is overloaded.', 'status': 'UNAVAILABLE'}})
+                return
+
+            items = json.loads(prompt.split("JSON_INPUT:", 1)[1])
+            answer = json.dumps({k: fake_edit(v) for k, v in items.items()}, ensure_ascii=False)
+            with lock: stats['ok'] += 1
+            self._reply(200, {
+                'candidates': [{'content': {'role': 'model', 'parts': [{'text': answer}]}, 'finishReason': 'STOP', 'index': 0}],
+                'usageMetadata': {'promptTokenCount': len(prompt) // CHARS_PER_TOKEN,
+                                  'candidatesTokenCount': len(answer) // CHARS_PER_TOKEN,
+                                  'totalTokenCount': (len(prompt) + len(answer)) // CHARS_PER_TOKEN},
+            })
+        finally:
+            with lock: stats['in_flight'] -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub of the Gemini generate_content API for 04_editor.py")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--rpm', type=int, default=10)
+    parser.add_argument('--tpm', type=int, default=125000)
+    parser.add_argument('--latency', type=float, default=3.0, help='Средняя задержка ответа, сек.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Доля ответов 503')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.args = args
+    print(f"Stub generate_content on http://{args.host}:{args.port} (rpm={args.rpm}, tpm={args.tpm})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"\nStats: {stats}")
+
+if __name__ == "__main__":
+    main()
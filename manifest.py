@@ -0,0 +1,413 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+import config
+import schedule
+import audio_io
+
+DB_PATH = config.DIR_CACHE / 'manifest.sqlite'
+
+# Этап -> (папка, расширение, предыдущий этап)
+STAGES = {
+    'video': (config.DIR_VIDEO_RAW, '.mp4', None),
+    'audio': (config.DIR_AUDIO_WAV, audio_io.AUDIO_EXT, 'video'),
+    'stt':   (config.DIR_TEXT_RAW, '.txt', 'audio'),
+    'clean': (config.DIR_TEXT_CLEAN, '.txt', 'stt'),
+}
+
+FULL_HASH_LIMIT = 8 * 1024 * 1024
+SAMPLE_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (
+    topic_id   INTEGER PRIMARY KEY,
+    rel_path   TEXT NOT NULL,
+    player_url TEXT,
+    title      TEXT,
+    source_key TEXT,
+    dup_of     INTEGER
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    topic_id   INTEGER NOT NULL,
+    stage      TEXT NOT NULL,
+    path       TEXT,
+    size       INTEGER,
+    mtime      REAL,
+    hash       TEXT,
+    status     TEXT NOT NULL,
+    error      TEXT,
+    updated_at REAL,
+    PRIMARY KEY (topic_id, stage)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    path        TEXT NOT NULL,
+    start       INTEGER NOT NULL,
+    stop        INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    text        TEXT,
+    status      TEXT NOT NULL,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    updated_at  REAL,
+    PRIMARY KEY (path, start, stop)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_topics_rel_path ON topics(rel_path);
+CREATE INDEX IF NOT EXISTS idx_topics_source_key ON topics(source_key);
+CREATE INDEX IF NOT EXISTS idx_topics_dup_of ON topics(dup_of);
+CREATE INDEX IF NOT EXISTS idx_artifacts_stage_status ON artifacts(stage, status);
+"""
+
+# Добавленные позже колонки — для манифестов, созданных старой версией
+MIGRATIONS = {
+    'topics': [('source_key', 'TEXT'), ('dup_of', 'INTEGER')],
+}
+
+# Этапы, результаты которых раздаются дублям (лекциям с тем же потоком)
+FAN_OUT_STAGES = ('audio', 'stt')
+FICLONE = 0x40049409
+
+_local = threading.local()
+
+def get_conn():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(DB_PATH), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        for table, columns in MIGRATIONS.items():
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, col_type in columns:
+                if name not in existing: conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+        conn.executescript(INDEXES)
+        _local.conn = conn
+    return conn
+
+
+def file_hash(path):
+    # Тексты хешируем целиком, у больших медиафайлов — размер + начало и конец
+    size = os.path.getsize(path)
+    hash_md5 = hashlib.md5(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= FULL_HASH_LIMIT:
+            for chunk in iter(lambda: f.read(65536), b""):
+                hash_md5.update(chunk)
+        else:
+            hash_md5.update(f.read(SAMPLE_SIZE))
+            f.seek(-SAMPLE_SIZE, os.SEEK_END)
+            hash_md5.update(f.read(SAMPLE_SIZE))
+    return hash_md5.hexdigest()
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+        with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        return True
+    except (ImportError, OSError):
+        try: os.remove(dst)
+        except OSError: pass
+        return False
+
+def link_or_copy(src, dst):
+    # Жесткая ссылка -> reflink (CoW) -> обычная копия. Писатели всегда делают
+    # os.replace, поэтому общий inode никогда не перезаписывается на месте.
+    src, dst = str(src), str(dst)
+    if os.path.exists(dst) and os.path.samefile(src, dst): return 'same'
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = dst + ".part"
+    if os.path.exists(tmp_path): os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+        method = 'hardlink'
+    except OSError:
+        if _reflink(src, tmp_path):
+            method = 'reflink'
+        else:
+            shutil.copyfile(src, tmp_path)
+            method = 'copy'
+    os.replace(tmp_path, dst)
+    return method
+
+def link_duplicate(src, dst):
+    for companion in audio_io.companion_files(src):
+        link_or_copy(companion, str(dst) + companion.name[len(Path(src).name):])
+    return link_or_copy(src, dst)
+
+def source_key(url):
+    # Токены в query меняются от запуска к запуску, сам поток — нет
+    return url.split('?')[0] if url else None
+
+def stage_path(rel_path, stage):
+    directory, ext, _ = STAGES[stage]
+    return directory / (rel_path + ext)
+
+def rel_path_of(stage, path):
+    directory, _, _ = STAGES[stage]
+    rel = Path(path).relative_to(directory)
+    if rel.name.startswith("MERGED_"):
+        rel = rel.with_name(rel.name[len("MERGED_"):])
+    return rel.with_suffix('').as_posix()
+
+def topic_id_of(stage, path):
+    row = get_conn().execute("SELECT topic_id FROM topics WHERE rel_path = ?", (rel_path_of(stage, path),)).fetchone()
+    return row['topic_id'] if row else None
+
+
+def register_topics(tasks):
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO topics (topic_id, rel_path, player_url, title) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(topic_id) DO UPDATE SET rel_path = excluded.rel_path, player_url = excluded.player_url, title = excluded.title",
+            [(t['topic_id'], rel_path_of('video', t['target_path']), t['player_url'], t['title']) for t in tasks]
+        )
+
+def _set(topic_ids, stage, status, path=None, with_hash=False, error=None):
+    size = mtime = content_hash = None
+    if path is not None and os.path.exists(path):
+        st = os.stat(path)
+        size, mtime = st.st_size, st.st_mtime
+        if with_hash: content_hash = file_hash(path)
+
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO artifacts (topic_id, stage, path, size, mtime, hash, status, error, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(tid, stage, str(path) if path else None, size, mtime, content_hash, status, error, time.time()) for tid in topic_ids]
+        )
+
+def mark_running(stage, path):
+    tid = topic_id_of(stage, path)
+    if tid is not None: _set([tid], stage, 'running', path)
+
+def mark_done(stage, path, topic_ids=None):
+    fan_out = topic_ids is None and stage in FAN_OUT_STAGES
+    if topic_ids is None:
+        tid = topic_id_of(stage, path)
+        topic_ids = [tid] if tid is not None else []
+    _set(topic_ids, stage, 'done', path, with_hash=True)
+
+    if fan_out:
+        for dup_id, dup_path in duplicate_targets(stage, path):
+            link_duplicate(path, dup_path)
+            _set([dup_id], stage, 'done', dup_path, with_hash=True)
+
+def fan_out(stage, path, dup_paths):
+    # Раздает готовый результат лекциям с тем же звуком (найденным не по ссылке на поток)
+    for dup_path in dup_paths:
+        link_duplicate(path, dup_path)
+        mark_done(stage, dup_path)
+
+def mark_failed(stage, path, error=None):
+    tid = topic_id_of(stage, path)
+    if tid is not None: _set([tid], stage, 'failed', path, error=str(error) if error else None)
+
+def _is_fresh(row):
+    # Запись "done" действительна, только пока файл не изменился
+    if row is None or row['status'] != 'done' or not row['path']: return False
+    try:
+        st = os.stat(row['path'])
+    except OSError:
+        return False
+    return st.st_size == row['size'] and st.st_mtime == row['mtime']
+
+def get_artifact(stage, path):
+    return get_conn().execute(
+        "SELECT a.* FROM artifacts a JOIN topics t ON t.topic_id = a.topic_id WHERE t.rel_path = ? AND a.stage = ?",
+        (rel_path_of(stage, path), stage)
+    ).fetchone()
+
+def is_done(stage, path):
+    return _is_fresh(get_artifact(stage, path))
+
+def content_hash(stage, path):
+    row = get_artifact(stage, path)
+    if _is_fresh(row) and row['hash']: return row['hash']
+    return file_hash(path)
+
+
+def set_sources(tasks, m3u8_map):
+    rows = [(source_key(m3u8_map[t['player_url']]), t['topic_id']) for t in tasks if t['player_url'] in m3u8_map]
+    conn = get_conn()
+    with conn:
+        conn.executemany("UPDATE topics SET source_key = ? WHERE topic_id = ?", rows)
+        # Каноническая лекция потока — с наименьшим topic_id, остальные ссылаются на нее
+        conn.execute(
+            "UPDATE topics SET dup_of = NULLIF((SELECT MIN(t2.topic_id) FROM topics t2 WHERE t2.source_key = topics.source_key), topic_id) "
+            "WHERE source_key IS NOT NULL"
+        )
+    fan_out_existing()
+
+# Дубли, найденные уже после обработки канонической лекции, получают ее готовые результаты
+def fan_out_existing():
+    for stage in FAN_OUT_STAGES:
+        rows = get_conn().execute(
+            "SELECT d.topic_id, d.rel_path, a.path, a.status, a.size, a.mtime FROM topics d "
+            "JOIN artifacts a ON a.topic_id = d.dup_of AND a.stage = ? AND a.status = 'done' "
+            "LEFT JOIN artifacts da ON da.topic_id = d.topic_id AND da.stage = ? "
+            "WHERE d.dup_of IS NOT NULL AND (da.status IS NULL OR da.status != 'done')", (stage, stage)
+        ).fetchall()
+        for row in rows:
+            if not _is_fresh(row): continue
+            dup_path = stage_path(row['rel_path'], stage).with_suffix(Path(row['path']).suffix)
+            link_duplicate(row['path'], dup_path)
+            _set([row['topic_id']], stage, 'done', dup_path, with_hash=True)
+
+def find_source_artifact(stage, key):
+    rows = get_conn().execute(
+        "SELECT a.* FROM artifacts a JOIN topics t ON t.topic_id = a.topic_id "
+        "WHERE t.source_key = ? AND a.stage = ? AND a.status = 'done'", (key, stage)
+    ).fetchall()
+    return next((row['path'] for row in rows if _is_fresh(row)), None)
+
+def duplicate_targets(stage, path):
+    tid = topic_id_of(stage, path)
+    if tid is None: return []
+    rows = get_conn().execute("SELECT topic_id, rel_path FROM topics WHERE dup_of = ?", (tid,)).fetchall()
+    return [(row['topic_id'], stage_path(row['rel_path'], stage).with_suffix(Path(path).suffix)) for row in rows]
+
+def is_duplicate(topic_id):
+    row = get_conn().execute("SELECT dup_of FROM topics WHERE topic_id = ?", (topic_id,)).fetchone()
+    return bool(row and row['dup_of'] is not None)
+
+def duplicate_paths(stage, path):
+    return [p for _, p in duplicate_targets(stage, path) if is_done(stage, p)]
+
+
+# Чекпоинты транскрибации: текст каждого готового куска аудио (offset -> text).
+# fingerprint — модель и настройки нарезки; при их смене старые куски не используются.
+def load_chunks(path, fingerprint):
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM chunks WHERE path = ? AND fingerprint != ?", (str(path), fingerprint))
+    rows = conn.execute("SELECT start, stop, text FROM chunks WHERE path = ? AND status = 'done'", (str(path),)).fetchall()
+    return {(row['start'], row['stop']): row['text'] for row in rows}
+
+def save_chunks(path, fingerprint, rows):
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO chunks (path, start, stop, fingerprint, text, status, error, attempts, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 'done', NULL, 1, ?) "
+            "ON CONFLICT(path, start, stop) DO UPDATE SET fingerprint = excluded.fingerprint, text = excluded.text, "
+            "status = 'done', error = NULL, attempts = chunks.attempts + 1, updated_at = excluded.updated_at",
+            [(str(path), start, stop, fingerprint, text, time.time()) for start, stop, text in rows]
+        )
+
+def fail_chunks(path, fingerprint, spans, error):
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO chunks (path, start, stop, fingerprint, text, status, error, attempts, updated_at) "
+            "VALUES (?, ?, ?, ?, NULL, 'failed', ?, 1, ?) "
+            "ON CONFLICT(path, start, stop) DO UPDATE SET fingerprint = excluded.fingerprint, status = 'failed', "
+            "error = excluded.error, attempts = chunks.attempts + 1, updated_at = excluded.updated_at",
+            [(str(path), start, stop, fingerprint, str(error), time.time()) for start, stop in spans]
+        )
+
+def clear_chunks(path):
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM chunks WHERE path = ?", (str(path),))
+
+
+# Элементы, для которых предыдущий этап готов, а этот — нет. Один индексный запрос.
+def plan(stage, topic_ids=None, force=False, require_prev=True):
+    prev = STAGES[stage][2] if require_prev else None
+    params = []
+    if prev:
+        sql = ("SELECT t.topic_id, t.rel_path, t.player_url, t.title, up.path AS input_path, up.hash AS input_hash FROM topics t "
+               "JOIN artifacts up ON up.topic_id = t.topic_id AND up.stage = ? AND up.status = 'done' ")
+        params.append(prev)
+    else:
+        sql = "SELECT t.topic_id, t.rel_path, t.player_url, t.title, NULL AS input_path, NULL AS input_hash FROM topics t "
+    sql += "LEFT JOIN artifacts a ON a.topic_id = t.topic_id AND a.stage = ? "
+    params.append(stage)
+    # Дубли не планируются отдельно: они получают результат канонической лекции
+    sql += "WHERE " + ("t.dup_of IS NULL " if stage in FAN_OUT_STAGES else "1 ")
+    if not force:
+        sql += "AND (a.status IS NULL OR a.status != 'done') "
+    if topic_ids is not None:
+        topic_ids = list(topic_ids)
+        sql += f"AND t.topic_id IN ({','.join('?' * len(topic_ids))}) "
+        params.extend(topic_ids)
+    return get_conn().execute(sql + "ORDER BY t.rel_path", params).fetchall()
+
+# Сбрасывает 'done' у артефактов, файлы которых пропали или изменились
+def verify(stage=None):
+    conn = get_conn()
+    sql = "SELECT * FROM artifacts WHERE status = 'done'" + (" AND stage = ?" if stage else "")
+    stale = [(r['topic_id'], r['stage']) for r in conn.execute(sql, (stage,) if stage else ()).fetchall() if not _is_fresh(r)]
+    with conn:
+        conn.executemany("UPDATE artifacts SET status = 'stale', updated_at = ? WHERE topic_id = ? AND stage = ?",
+                         [(time.time(), tid, st) for tid, st in stale])
+    return len(stale)
+
+
+# Заполняет манифест по расписанию и уже существующим файлам (первый запуск / ручные правки)
+def sync():
+    tasks = schedule.query()
+    register_topics(tasks)
+
+    found = 0
+    for task in tasks:
+        rel_path = rel_path_of('video', task['target_path'])
+        for stage in STAGES:
+            path = stage_path(rel_path, stage)
+            if stage == 'clean' and not path.exists():
+                path = path.with_name("MERGED_" + path.name)
+            if path.exists() and path.stat().st_size > 0 and not is_done(stage, path):
+                _set([task['topic_id']], stage, 'done', path, with_hash=True)
+                found += 1
+
+    conn = get_conn()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)", (str(time.time()),))
+    return len(tasks), found
+
+def ensure_synced():
+    if get_conn().execute("SELECT 1 FROM meta WHERE key = 'synced_at'").fetchone() is None:
+        print("--- Manifest: первичное сканирование файлов ---")
+        sync()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline manifest (SQLite)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('sync', help='Пересканировать расписание и файлы на диске')
+    subparsers.add_parser('verify', help='Сбросить статус у измененных/удаленных файлов')
+    subparsers.add_parser('status', help='Сводка по этапам')
+    args = parser.parse_args()
+
+    if args.command == 'sync':
+        topics, found = sync()
+        print(f"Topics: {topics}, новых артефактов: {found}")
+    elif args.command == 'verify':
+        print(f"Устаревших записей: {verify()}")
+    elif args.command == 'status':
+        ensure_synced()
+        total = get_conn().execute("SELECT COUNT(*) FROM topics").fetchone()[0]
+        print(f"Topics: {total}")
+        for row in get_conn().execute("SELECT stage, status, COUNT(*) AS n FROM artifacts GROUP BY stage, status ORDER BY stage"):
+            print(f"  {row['stage']:<6} {row['status']:<8} {row['n']}")
+        for row in get_conn().execute("SELECT status, COUNT(DISTINCT path) AS files, COUNT(*) AS n FROM chunks GROUP BY status"):
+            print(f"  chunks {row['status']:<8} {row['n']} ({row['files']} файлов)")
+
+if __name__ == "__main__":
+    main()
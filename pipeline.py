@@ -0,0 +1,306 @@
+import os
+import time
+import queue
+import asyncio
+import argparse
+import importlib
+import threading
+from pathlib import Path
+import config
+import manifest
+import schedule
+import edit_plan
+import edit_backend
+
+# Номерные скрипты импортируются по имени модуля; тяжелые этапы (torch, genai,
+# sentence-transformers) подгружаются лениво внутри своих воркеров.
+downloader = importlib.import_module("01_downloader")
+extractor = importlib.import_module("02_extractor")
+
+STAGES = ['download', 'extract', 'transcribe', 'punctuate', 'edit', 'evaluate']
+DONE = object()
+
+
+def start_stage(name, make_handler, inbox, outbox, workers, stats):
+    stats[name] = {'ok': 0, 'fail': 0, 'busy': 0.0, 'workers': workers}
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            handle, flush = make_handler()
+        except Exception as e:
+            print(f"[{name}] [FAIL] Не удалось запустить этап: {e}")
+            handle, flush = None, None
+
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                inbox.put(DONE)
+                break
+            if handle is None:
+                with lock: stats[name]['fail'] += 1
+                continue
+
+            start_t = time.time()
+            try:
+                results = handle(item)
+            except Exception as e:
+                print(f"[{name}] [ERR] {item}: {e}")
+                results = None
+            with lock:
+                stats[name]['busy'] += time.time() - start_t
+                stats[name]['ok' if results is not None else 'fail'] += 1
+
+            for result in results or []:
+                if outbox is not None: outbox.put(result)
+
+        if flush:
+            start_t = time.time()
+            try:
+                for result in flush() or []:
+                    if outbox is not None: outbox.put(result)
+            except Exception as e:
+                print(f"[{name}] [ERR] {e}")
+            with lock: stats[name]['busy'] += time.time() - start_t
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for t in threads: t.start()
+
+    def closer():
+        for t in threads: t.join()
+        if outbox is not None: outbox.put(DONE)
+
+    closer_thread = threading.Thread(target=closer, name=f"{name}-closer", daemon=True)
+    closer_thread.start()
+    return closer_thread
+
+
+def make_download_handler(stats):
+    def handle(group):
+        processed_files_cache = {}
+        for i, task in enumerate(group['tasks']):
+            stage, output_path = downloader.task_output(task)
+            ok = manifest.is_done(stage, output_path) or downloader.process_task(task, group['m3u8_map'], processed_files_cache)
+            if i == 0:
+                primary = Path(output_path) if ok else None
+            elif not ok:
+                # Неудачная ссылка для дубля не мешает обработке самой лекции
+                # (list.append атомарен — общий список для всех воркеров загрузки)
+                stats['duplicates_failed'].append(task['title'])
+        # Дальше идет только каноническая лекция потока, дубли получат ее результаты
+        return [primary] if primary else None
+    return handle, None
+
+def make_extract_handler():
+    def handle(video_path):
+        audio_path = extractor.extract_one(video_path)
+        return [audio_path] if manifest.is_done('audio', audio_path) else None
+    return handle, None
+
+def make_transcribe_handler():
+    transcriber = importlib.import_module("03_transcriber")
+    model = transcriber.load_asr_model()
+
+    def handle(wav_path):
+        # Пунктуация — отдельный этап, GPU сразу берет следующий файл
+        txt_path = transcriber.get_txt_path(wav_path)
+        if manifest.is_done('stt', txt_path):
+            return [(wav_path, None)]
+        try:
+            raw_text = transcriber.transcribe_raw(wav_path, model)
+        except Exception as e:
+            # Как в 03_transcriber: иначе запись так и останется в 'running'
+            manifest.mark_failed('stt', txt_path, e)
+            raise
+        return [(wav_path, raw_text)]
+    return handle, None
+
+def make_punctuate_handler():
+    transcriber = importlib.import_module("03_transcriber")
+    punct_model = transcriber.load_punct_model()
+
+    def handle(item):
+        wav_path, raw_text = item
+        if raw_text is None:
+            return [transcriber.get_txt_path(wav_path)]
+        txt_path, _ = transcriber.save_text(wav_path, raw_text, punct_model)
+        return [txt_path]
+    return handle, None
+
+def make_edit_handler(force):
+    editor = importlib.import_module("04_editor")
+    client = editor.make_client()
+    capacity = editor.batch_capacity(client)
+    pending, pending_tokens = [], []
+    # Один event loop на воркер: асинхронный HTTP-клиент Gemini не переживает смену loop
+    loop = asyncio.new_event_loop()
+
+    def send(files):
+        saved = []
+        groups = editor.stale_groups(editor.group_files(files), force)
+        items = editor.build_items(groups, client)
+        editor.run_batches(client, items, on_saved=saved.extend, loop=loop)
+        return saved
+
+    def handle(txt_path):
+        pending.append(txt_path)
+        pending.extend(Path(p) for p in manifest.duplicate_paths('stt', txt_path))
+        # Копим тексты до полного батча, чтобы не тратить лишние запросы
+        pending_tokens.append(edit_plan.estimate_tokens(Path(txt_path).read_text('utf-8')))
+        if sum(pending_tokens) < capacity:
+            return []
+        pending_tokens.clear()
+        files = pending[:]
+        pending.clear()
+        return send(files)
+
+    def flush():
+        try:
+            return send(pending) if pending else []
+        finally:
+            client.close()
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+    return handle, flush
+
+def make_evaluate_handler(output):
+    evaluator = importlib.import_module("05_evaluator")
+    model = evaluator.load_model()
+    report_data = []
+
+    def handle(stt_path):
+        row = evaluator.evaluate_file(model, stt_path)
+        if row: report_data.append(row)
+        return []
+
+    def flush():
+        evaluator.write_report(report_data, output)
+        return []
+    return handle, flush
+
+
+def queue_downloads(tasks, download_q, stats):
+    done = {id(t) for t in tasks if manifest.is_done(*downloader.task_output(t))}
+    ready = [t for t in tasks if id(t) in done]
+    missing = [t for t in tasks if id(t) not in done]
+
+    # Уже скачанные лекции сразу уходят дальше, пока браузер ищет ссылки
+    for t in ready:
+        if not manifest.is_duplicate(t['topic_id']):
+            download_q.put({'tasks': [t], 'm3u8_map': {}})
+
+    if missing:
+        m3u8_map = asyncio.run(downloader.resolve_m3u8_links(list({t['player_url'] for t in missing})))
+        manifest.set_sources(missing, m3u8_map)
+        by_source = {}
+        for t in missing:
+            if t['player_url'] not in m3u8_map:
+                print(f"SKIP: Нет видео для {t['title']}")
+                # Счетчик только этого потока: воркеры этапов его не трогают, читается после join
+                stats['skipped'] += 1
+                continue
+            by_source.setdefault(manifest.source_key(m3u8_map[t['player_url']]), []).append(t)
+
+        for group in by_source.values():
+            group.sort(key=lambda t: t['topic_id'])
+            download_q.put({'tasks': group, 'm3u8_map': m3u8_map})
+
+def feed_downloads(tasks, download_q, stats):
+    # DONE уходит в любом случае: без него воркеры этапов навсегда зависнут на inbox.get()
+    try:
+        queue_downloads(tasks, download_q, stats)
+    except Exception as e:
+        print(f"[download] [FAIL] Не удалось подготовить загрузки: {e}")
+    finally:
+        download_q.put(DONE)
+
+
+def parse_workers(values):
+    workers = dict(config.PIPELINE_WORKERS)
+    for v in values:
+        name, _, count = v.partition('=')
+        if name not in STAGES or not count.isdigit():
+            raise SystemExit(f"Неверный формат --workers: {v} (ожидается stage=N)")
+        workers[name] = max(1, int(count))
+    return workers
+
+def main():
+    parser = argparse.ArgumentParser(description="AIJ Streaming Pipeline")
+    parser.add_argument('--all', action='store_true', help='Все залы')
+    schedule.add_filter_args(parser)
+    parser.add_argument('--until', choices=STAGES, default='evaluate', help='Последний этап пайплайна')
+    parser.add_argument('--workers', nargs='+', default=[], help='Число воркеров: download=2 extract=4 ...')
+    parser.add_argument('--queue-size', type=int, default=config.PIPELINE_QUEUE_SIZE)
+    parser.add_argument('--single-pass', action='store_true', help='Загрузка сразу в MP4 + WAV одним ffmpeg')
+    parser.add_argument('--audio-only', action='store_true', help='Качать только аудио (без видео и этапа extract)')
+    parser.add_argument('--force', action='store_true', help='Перезаписать отредактированные тексты')
+    parser.add_argument('--output', default="evaluation_report.csv", help='CSV отчета этапа 5')
+    args = parser.parse_args()
+
+    if not args.all and not schedule.has_filters(args):
+        print("Используйте: --all ИЛИ --halls/--days/--speakers/--tags/--ids ...")
+        return
+
+    # Сырой текст без этапа пунктуации не сохраняется, поэтому они идут парой
+    last = STAGES.index('punctuate') if args.until == 'transcribe' else STAGES.index(args.until)
+    stages = STAGES[:last + 1]
+    if args.single_pass: config.SINGLE_PASS = True
+    if args.audio_only:
+        config.AUDIO_ONLY = True
+        stages = [s for s in stages if s != 'extract']
+    workers = parse_workers(args.workers)
+
+    extractor.check_ffmpeg()
+    if not downloader.check_ffmpeg():
+        print("\n[!!!] FFMPEG НЕ НАЙДЕН. Скачайте ffmpeg.exe.")
+        return
+    if 'edit' in stages and edit_backend.missing_credentials():
+        print(f"ERROR: {edit_backend.missing_credentials()}")
+        return
+
+    for d in [config.OUTPUT_DIR, config.TEMP_DIR]:
+        os.makedirs(d, exist_ok=True)
+
+    tasks = downloader.collect_tasks(schedule.select(args), only_missing=False)
+    print(f"--- Pipeline: {len(tasks)} лекций, этапы: {' -> '.join(stages)} ---")
+
+    stats = {'skipped': 0, 'duplicates_failed': []}
+    handlers = {
+        'download': lambda: make_download_handler(stats),
+        'extract': make_extract_handler,
+        'transcribe': make_transcribe_handler,
+        'punctuate': make_punctuate_handler,
+        'edit': lambda: make_edit_handler(args.force),
+        'evaluate': lambda: make_evaluate_handler(args.output),
+    }
+
+    # Ограниченные очереди дают backpressure: быстрый этап ждет медленный
+    queues = [queue.Queue(maxsize=args.queue_size) for _ in stages]
+    start_t = time.time()
+
+    closers = []
+    for i, name in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        closers.append(start_stage(name, handlers[name], queues[i], outbox, workers[name], stats))
+
+    feeder = threading.Thread(target=feed_downloads, args=(tasks, queues[0], stats), daemon=True)
+    feeder.start()
+
+    for t in closers: t.join()
+    feeder.join()
+
+    wall = time.time() - start_t
+    print("\n" + "="*30)
+    for name in stages:
+        s = stats[name]
+        load = s['busy'] / (wall * s['workers']) * 100 if wall > 0 else 0
+        print(f"{name:<11} OK: {s['ok']:<4} FAIL: {s['fail']:<4} busy: {int(s['busy'])}с ({load:.0f}%)")
+    if stats['skipped']:
+        print(f"{'skipped':<11} Нет видео: {stats['skipped']}")
+    if stats['duplicates_failed']:
+        print(f"{'duplicates':<11} Не связано дублей: {len(stats['duplicates_failed'])}")
+    print(f"ИТОГ: {int(wall)}с")
+    print("="*30)
+
+if __name__ == "__main__":
+    main()
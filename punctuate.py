@@ -0,0 +1,54 @@
+import config
+
+# Пунктуация длинных текстов: слова режутся на перекрывающиеся окна, окна идут
+# в token-classification pipeline батчами, а для каждого слова берется предсказание
+# из того окна, где у него больше всего контекста.
+
+def split_windows(n_words, size, overlap):
+    step = max(1, size - overlap)
+    windows = []
+    for start in range(0, n_words, step):
+        windows.append((start, min(start + size, n_words)))
+        if start + size >= n_words: break
+    return windows
+
+def tag_window(words, result):
+    # Разметка слов окна по сабтокенам (как в deepmultilingualpunctuation.predict)
+    tagged = []
+    char_index = 0
+    result_index = 0
+    for word in words:
+        char_index += len(word) + 1
+        label, score = "0", 1.0
+        while result_index < len(result) and char_index > result[result_index]["end"]:
+            label = result[result_index]["entity"]
+            score = result[result_index]["score"]
+            result_index += 1
+        tagged.append([word, label, score])
+    return tagged
+
+def restore(punct_model, text):
+    # Нужные части PunctuationModel: preprocess, pipe, prediction_to_text; иначе — штатный вызов
+    if not all(hasattr(punct_model, name) for name in ("preprocess", "pipe", "prediction_to_text")):
+        return punct_model.restore_punctuation(text)
+
+    words = punct_model.preprocess(text)
+    if not words: return text
+
+    size, overlap = config.PUNCT_WINDOW_WORDS, config.PUNCT_OVERLAP_WORDS
+    windows = split_windows(len(words), size, overlap)
+    results = punct_model.pipe([" ".join(words[s:e]) for s, e in windows], batch_size=config.PUNCT_BATCH_SIZE)
+    if len(windows) == 1 and results and isinstance(results[0], dict):
+        results = [results]
+
+    # Склейка: зона перекрытия делится пополам между соседними окнами
+    tagged = []
+    for k, ((start, end), result) in enumerate(zip(windows, results)):
+        window_tags = tag_window(words[start:end], result)
+        lo = 0 if k == 0 else overlap // 2
+        hi = len(window_tags) if k == len(windows) - 1 else len(window_tags) - (overlap - overlap // 2)
+        # Последнее окно может начинаться глубже, чем кончается ядро предыдущего
+        lo = max(lo, len(tagged) - start)
+        tagged.extend(window_tags[lo:hi])
+
+    return punct_model.prediction_to_text(tagged)
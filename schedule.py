@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import pickle
+from datetime import datetime
+import config
+
+INDEX_PATH = config.DIR_CACHE / 'schedule_index.pkl'
+INDEX_VERSION = 1
+_index = None
+
+
+def clean_name(s):
+    if not s: return "Unknown"
+    s = str(s).strip().replace(':', ' -').replace('/', '_').replace('\\', '_')
+    s = re.sub(r'[?*<>|"]', '', s)
+    return re.sub(r'\s+', ' ', s).strip()
+
+def truncate_string(s, max_len):
+    if len(s) <= max_len: return s
+    return s[:max_len].rstrip() + "..."
+
+def extract_time(iso_date_str):
+    try:
+        dt = datetime.fromisoformat(iso_date_str)
+        return dt.strftime('%H-%M')
+    except:
+        return "00-00"
+
+def load_schedule():
+    with open(config.JSON_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def iter_topics(data):
+    # Фильтрация по залам и датам — в query(), здесь только лекции с видео
+    for day in data:
+        for hall in day.get('halls', []):
+            for topic in hall.get('topics', []):
+                if topic.get('isBreak') or not topic.get('videos'): continue
+                if not topic['videos'][0].get('videoUrl'): continue
+                yield day, hall, topic
+
+def build_target_path(day, hall, topic):
+    date_folder = clean_name(day.get('concreteDate'))
+    hall_folder = clean_name(hall.get('name', 'Unknown'))
+    safe_title = truncate_string(clean_name(topic.get('title')), config.MAX_TITLE_LEN)
+    safe_speaker = truncate_string(clean_name(", ".join(filter(None, [s.get('fullName') for s in topic.get('speakers', [])]))) or "Speaker", config.MAX_SPEAKER_LEN)
+    time_str = extract_time(topic.get('startDate'))
+
+    filename = config.FILENAME_FORMAT.format(time=time_str, speaker=safe_speaker, title=safe_title)
+    if len(filename) > config.MAX_FILENAME_LENGTH:
+        name_part, ext = os.path.splitext(filename)
+        filename = name_part[:config.MAX_FILENAME_LENGTH] + ext
+
+    return os.path.join(config.OUTPUT_DIR, date_folder, hall_folder, filename)
+
+
+def _index_key():
+    # Индекс зависит от файла расписания и от настроек, из которых строятся пути
+    st = os.stat(config.JSON_PATH)
+    return (INDEX_VERSION, st.st_size, st.st_mtime, str(config.OUTPUT_DIR), config.FILENAME_FORMAT,
+            config.MAX_TITLE_LEN, config.MAX_SPEAKER_LEN, config.MAX_FILENAME_LENGTH)
+
+def build_index(data):
+    topics = []
+    by = {'day': {}, 'hall': {}, 'speaker': {}, 'tag': {}}
+    day_order = {}
+
+    for day, hall, topic in iter_topics(data):
+        date = day.get('concreteDate') or "Unknown"
+        day_order.setdefault(date, len(day_order) + 1)
+        target_path = build_target_path(day, hall, topic)
+        record = {
+            'topic_id': topic.get('id'),
+            'player_url': topic['videos'][0]['videoUrl'],
+            'target_path': target_path,
+            'title': os.path.basename(target_path),
+            'topic_title': topic.get('title') or "",
+            'day': date,
+            'day_num': day_order[date],
+            'hall': hall.get('name', 'Unknown'),
+            'start': topic.get('startDate'),
+            'speakers': [s.get('fullName') for s in topic.get('speakers', []) if s.get('fullName')],
+            'tags': sorted({t.get('name') for t in topic.get('tags', []) + day.get('tags', []) if t.get('name')}),
+        }
+        i = len(topics)
+        topics.append(record)
+        by['day'].setdefault(date, []).append(i)
+        by['day'].setdefault(str(record['day_num']), []).append(i)
+        by['hall'].setdefault(record['hall'].lower(), []).append(i)
+        for name in record['speakers']: by['speaker'].setdefault(name.lower(), []).append(i)
+        for name in record['tags']: by['tag'].setdefault(name.lower(), []).append(i)
+
+    return {'topics': topics, 'by': by, 'by_id': {r['topic_id']: i for i, r in enumerate(topics)}}
+
+def load_index():
+    global _index
+    key = _index_key()
+    if _index is not None and _index['key'] == key:
+        return _index
+
+    try:
+        with open(INDEX_PATH, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('key') == key:
+            _index = cached
+            return _index
+    except Exception:
+        pass
+
+    _index = build_index(load_schedule())
+    _index['key'] = key
+    try:
+        INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = INDEX_PATH.with_name(INDEX_PATH.name + ".part")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, INDEX_PATH)
+    except OSError:
+        pass
+    return _index
+
+def _match(field, values, index):
+    # Подстрока по ключам индекса (как раньше с залами): "main" найдет "Main Stage" и "Main stage"
+    hits = set()
+    for v in values:
+        v = str(v).lower().strip()
+        for name, ids in index['by'][field].items():
+            if v == name or (field != 'day' and v in name):
+                hits.update(ids)
+    return hits
+
+def query(days=None, halls=None, speakers=None, tags=None, ids=None):
+    index = load_index()
+    selected = None
+    for field, values in [('day', days), ('hall', halls), ('speaker', speakers), ('tag', tags)]:
+        if values:
+            hits = _match(field, values, index)
+            selected = hits if selected is None else selected & hits
+    if ids:
+        hits = {index['by_id'][int(i)] for i in ids if int(i) in index['by_id']}
+        selected = hits if selected is None else selected & hits
+
+    if selected is None:
+        return list(index['topics'])
+    return [index['topics'][i] for i in sorted(selected)]
+
+def add_filter_args(parser):
+    parser.add_argument('--days', nargs='+', default=[], help='Дни: 2025-11-20 или номер дня (1, 2, 3)')
+    parser.add_argument('--halls', nargs='+', default=[], help='Фильтр залов (подстрока)')
+    parser.add_argument('--speakers', nargs='+', default=[], help='Фильтр спикеров (подстрока)')
+    parser.add_argument('--tags', nargs='+', default=[], help='Фильтр тегов')
+    parser.add_argument('--ids', nargs='+', type=int, default=[], help='ID тем из schedule.json')
+
+def has_filters(args):
+    return any(getattr(args, name, None) for name in ['days', 'halls', 'speakers', 'tags', 'ids'])
+
+def select(args):
+    return query(days=args.days, halls=args.halls, speakers=args.speakers, tags=args.tags, ids=args.ids)
+
+def selected_topic_ids(args):
+    # None — фильтров нет, обрабатываем все
+    if not has_filters(args): return None
+    return {r['topic_id'] for r in select(args)}
@@ -0,0 +1,180 @@
+import time
+import argparse
+import importlib
+from pathlib import Path
+import torch
+import config
+import audio_io
+
+# Бэкенды инференса GigaAM (config.STT_BACKEND):
+#   eager   — обычная модель fp32
+#   int8    — динамическая int8-квантизация nn.Linear (только CPU)
+#   compile — torch.compile энкодера
+#   onnx    — энкодер, экспортированный в ONNX и запущенный в onnxruntime (только CPU)
+# Проверка качества и скорости: python stt_backend.py --files 3
+
+BACKENDS = ['eager', 'int8', 'compile', 'onnx']
+ONNX_DIR = config.DIR_CACHE / 'onnx'
+
+
+def get_asr(model):
+    return getattr(model, "model", model)
+
+def apply_int8(asr):
+    return torch.ao.quantization.quantize_dynamic(asr, {torch.nn.Linear}, dtype=torch.qint8)
+
+def apply_compile(asr):
+    asr.encoder = torch.compile(asr.encoder, dynamic=True)
+    return asr
+
+class OnnxEncoder(torch.nn.Module):
+    # Подменяет энкодер: тот же интерфейс (features, lengths) -> (encoded, encoded_len)
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def forward(self, features, lengths):
+        encoded, encoded_len = self.session.run(None, {
+            'features': features.detach().cpu().float().numpy(),
+            'lengths': lengths.detach().cpu().numpy(),
+        })
+        return torch.from_numpy(encoded), torch.from_numpy(encoded_len)
+
+def onnx_path():
+    return ONNX_DIR / f"{config.MODEL_ID.replace('/', '_')}_{config.MODEL_REVISION}_encoder.onnx"
+
+def export_onnx(asr, path):
+    # Пример входа берем у препроцессора самой модели, чтобы форма признаков совпадала
+    wav = torch.zeros(1, audio_io.SAMPLE_RATE * 4)
+    features, lengths = asr.preprocessor(wav, torch.tensor([wav.shape[1]]))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".part")
+    torch.onnx.export(
+        asr.encoder, (features, lengths), str(tmp_path),
+        input_names=['features', 'lengths'], output_names=['encoded', 'encoded_len'],
+        dynamic_axes={'features': {0: 'batch', 2: 'time'}, 'lengths': {0: 'batch'},
+                      'encoded': {0: 'batch', 2: 'frames'}, 'encoded_len': {0: 'batch'}},
+        opset_version=17,
+    )
+    tmp_path.replace(path)
+
+def apply_onnx(asr):
+    import onnxruntime as ort
+    path = onnx_path()
+    if not path.exists():
+        print(f"Exporting encoder to {path}...")
+        export_onnx(asr, path)
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = torch.get_num_threads()
+    session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+    asr.encoder = OnnxEncoder(session)
+    return asr
+
+def apply(model, backend):
+    if backend in (None, '', 'eager'): return model
+    if backend in ('int8', 'onnx') and config.DEVICE != 'cpu':
+        print(f"[WARN] STT backend '{backend}' только для CPU, на {config.DEVICE} используется eager")
+        return model
+
+    # HF-обертка хранит модель в .model — подменяем ее там
+    asr = get_asr(model)
+    new_asr = {'int8': apply_int8, 'compile': apply_compile, 'onnx': apply_onnx}[backend](asr)
+    if asr is model: return new_asr
+    model.model = new_asr
+    return model
+
+
+# --- Проверка: WER/CER относительно eager fp32 и скорость ---
+
+def edit_distance(ref, hyp):
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1]
+
+def error_rate(refs, hyps, split):
+    # Куски у всех бэкендов одни и те же, поэтому сравниваем покусочно — это быстрее, чем весь текст разом
+    errors = sum(edit_distance(split(r), split(h)) for r, h in zip(refs, hyps))
+    return errors / max(1, sum(len(split(r)) for r in refs))
+
+def sample_files(args):
+    if args.paths: return [Path(p) for p in args.paths]
+    import manifest
+    manifest.ensure_synced()
+    rows = manifest.get_conn().execute(
+        "SELECT path FROM artifacts WHERE stage = 'audio' AND status = 'done' ORDER BY topic_id LIMIT ?", (args.files,)
+    ).fetchall()
+    return [Path(row['path']) for row in rows]
+
+def run_backend(transcriber, backend, files, max_chunks):
+    # Без чекпоинтов манифеста: каждый бэкенд распознает одни и те же первые куски заново
+    model = apply(transcriber.load_asr_model(), backend)
+    texts, audio_sec, wall = [], 0.0, 0.0
+    for i, path in enumerate(files):
+        audio, sr = audio_io.open_audio(path)
+        try:
+            spans = transcriber.chunk_spans(audio, sr)[:max_chunks]
+            batch_size = transcriber.auto_batch_size(int(config.VAD_MAX_CHUNK * sr), sr)
+            chunks = [chunk for _, _, chunk in audio_io.iter_chunks(audio, spans)]
+            if i == 0: transcriber.run_batch(model, chunks[:1], sr)  # прогрев (компиляция, аллокации)
+            start_t = time.perf_counter()
+            chunk_texts = []
+            for b in range(0, len(chunks), batch_size):
+                chunk_texts.extend(transcriber.run_batch(model, chunks[b:b + batch_size], sr))
+            wall += time.perf_counter() - start_t
+            audio_sec += sum(stop - start for start, stop in spans) / sr
+            texts.extend(chunk_texts)
+        finally:
+            audio_io.close_audio(audio)
+    return texts, audio_sec, wall
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare GigaAM inference backends against eager fp32")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--files', type=int, default=3, help='Сколько готовых аудио взять из манифеста')
+    parser.add_argument('paths', nargs='*', help='Или явные пути к аудио')
+    parser.add_argument('--max-chunks', type=int, default=30, help='Кусков на файл (~10 минут)')
+    parser.add_argument('--max-wer', type=float, default=config.STT_BACKEND_MAX_WER)
+    args = parser.parse_args()
+
+    transcriber = importlib.import_module("03_transcriber")
+    # load_asr_model сам применяет config.STT_BACKEND; для честного сравнения все модели грузятся
+    # чистыми, иначе "eager" окажется уже выбранным бэкендом, а кандидаты получат его дважды
+    configured_backend, config.STT_BACKEND = config.STT_BACKEND, 'eager'
+    files = sample_files(args)
+    if not files:
+        print("Нет аудио для проверки")
+        return
+    print(f"--- Backends on {config.DEVICE}, {len(files)} files, {torch.get_num_threads()} threads ---")
+    if configured_backend != 'eager':
+        print(f"(STT_BACKEND = \"{configured_backend}\" в config игнорируется: все бэкенды от fp32)")
+
+    backends = ['eager'] + [b for b in args.backends if b != 'eager']
+    reference = None
+    report = []
+    for backend in backends:
+        try:
+            texts, audio_sec, wall = run_backend(transcriber, backend, files, args.max_chunks)
+        except Exception as e:
+            print(f"{backend:<8} [FAIL] {e}")
+            if reference is None: return  # без eager сравнивать не с чем
+            continue
+        if reference is None: reference = texts
+        wer = error_rate(reference, texts, str.split)
+        cer = error_rate(reference, texts, list)
+        report.append((backend, audio_sec / wall if wall else 0.0, wer, cer))
+
+    print(f"\n{'backend':<8} {'x realtime':>10} {'WER':>7} {'CER':>7}")
+    for backend, speed, wer, cer in report:
+        print(f"{backend:<8} {speed:>10.1f} {wer:>7.2%} {cer:>7.2%}")
+
+    ok = [r for r in report if r[2] <= args.max_wer]
+    if ok:
+        best = max(ok, key=lambda r: r[1])
+        print(f"\nСамый быстрый в пределах WER {args.max_wer:.1%}: {best[0]} (STT_BACKEND = \"{best[0]}\")")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import json
+import argparse
+import urllib.error
+import urllib.request
+from pathlib import Path
+import config
+import schedule
+
+# Тонкий клиент к stt_server.py: без torch/transformers, стартует мгновенно.
+# manifest нужен только команде run и импортируется в ней.
+
+def server_url(args, path):
+    return f"http://{args.host}:{args.port}{path}"
+
+def request(args, path, data=None, content_type='application/json'):
+    req = urllib.request.Request(server_url(args, path), data=data, method='POST' if data is not None else 'GET')
+    if data is not None: req.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(req, timeout=None) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read().decode('utf-8') or '{}') | {'http_status': e.code}
+    except urllib.error.URLError as e:
+        print(f"Сервер недоступен ({args.host}:{args.port}): {e.reason}. Запустите: python stt_server.py")
+        sys.exit(1)
+
+def transcribe_path(args, path):
+    body = json.dumps({'path': str(Path(path).resolve())}).encode('utf-8')
+    return request(args, '/transcribe' + ('' if args.punct else '?punctuate=0'), body)
+
+def print_result(name, result):
+    if 'error' in result:
+        print(f"[ERR] {name}: {result['error']}")
+    elif result.get('txt_path'):
+        print(f"[OK] {name} -> {result['txt_path']}" + (" (уже готов)" if result.get('cached') else ""))
+    else:
+        print(result['text'])
+
+def cmd_run(args):
+    import manifest
+
+    files = [Path(row['input_path']) for row in manifest.plan('stt', topic_ids=schedule.selected_topic_ids(args))]
+    print(f"Files to process: {len(files)}")
+    for wav_path in files[:1] if args.test else files:
+        result = transcribe_path(args, wav_path)
+        print_result(wav_path.name, result)
+        if args.test and 'text' in result:
+            print(f"Sample: {result['text'][:300]}...")
+
+def main():
+    parser = argparse.ArgumentParser(description="Client for the STT daemon (stt_server.py)")
+    parser.add_argument('--host', default=config.STT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=config.STT_SERVER_PORT)
+    parser.add_argument('--no-punct', dest='punct', action='store_false', help='Без пунктуации (результат для output_audio тогда не сохраняется в output_stt)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('health', help='Проверить, что сервер запущен и модели загружены')
+    p_file = subparsers.add_parser('file', help='Распознать файлы по пути (файлы из output_audio сохраняются в output_stt)')
+    p_file.add_argument('paths', nargs='+')
+    p_stream = subparsers.add_parser('stream', help='Отправить аудио в теле запроса (файл или "-" для stdin)')
+    p_stream.add_argument('source')
+    p_stream.add_argument('--format', choices=['wav', 'flac', 's16'], default='wav')
+    p_run = subparsers.add_parser('run', help='Как 03_transcriber.py: все несделанные файлы из манифеста')
+    p_run.add_argument('--test', action='store_true', help='Только один файл')
+    schedule.add_filter_args(p_run)
+    subparsers.add_parser('stop', help='Остановить сервер')
+    args = parser.parse_args()
+
+    if args.command == 'health':
+        print(json.dumps(request(args, '/health'), ensure_ascii=False))
+    elif args.command == 'file':
+        for path in args.paths:
+            print_result(Path(path).name, transcribe_path(args, path))
+    elif args.command == 'stream':
+        data = sys.stdin.buffer.read() if args.source == '-' else Path(args.source).read_bytes()
+        query = f"?format={args.format}" + ('' if args.punct else '&punctuate=0')
+        print_result(args.source, request(args, '/transcribe/stream' + query, data, 'application/octet-stream'))
+    elif args.command == 'run':
+        cmd_run(args)
+    elif args.command == 'stop':
+        print(request(args, '/shutdown', b'').get('status'))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import json
+import argparse
+import tempfile
+import subprocess
+import importlib
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import config
+import manifest
+import punctuate
+import audio_io
+
+# Долгоживущий сервис распознавания: модели грузятся один раз и остаются в памяти,
+# запросы приходят от stt_client.py по HTTP на localhost.
+
+transcriber = importlib.import_module("03_transcriber")
+
+state = {}
+asr_lock = threading.Lock()    # одна модель на GPU — распознавание по очереди
+punct_lock = threading.Lock()  # пунктуация своя очередь, идет параллельно со следующим ASR
+
+
+def punctuate_text(raw_text):
+    with punct_lock:
+        if state['punct_model'] and raw_text and len(raw_text) > 5:
+            try:
+                return punctuate.restore(state['punct_model'], raw_text)
+            except Exception:
+                pass
+        return raw_text
+
+class BadAudio(ValueError):
+    pass
+
+def resample_to_model_rate(path):
+    # transcribe_file_native не пересэмплирует: на 44.1/48 кГц модель выдает мусор.
+    # Файл с другой частотой переводится ffmpeg во временный WAV 16 кГц моно.
+    try:
+        audio, sr = audio_io.open_audio(path)
+        audio_io.close_audio(audio)
+    except Exception as e:
+        raise BadAudio(f"не удалось открыть аудио: {e}")
+    if sr == audio_io.SAMPLE_RATE:
+        return None
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    raw_input = ['-f', 's16le', '-ar', str(sr), '-ac', '1'] if Path(path).suffix == '.s16' else []
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", *raw_input, "-i", str(path),
+           "-ar", str(audio_io.SAMPLE_RATE), "-ac", "1", "-c:a", "pcm_s16le", tmp_path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+        failed = result.returncode != 0
+    except FileNotFoundError:
+        failed = True
+    if failed:
+        os.remove(tmp_path)
+        raise BadAudio(f"частота {sr} Гц, модели нужно {audio_io.SAMPLE_RATE} Гц, а пересэмплировать через ffmpeg не удалось")
+    return Path(tmp_path)
+
+def transcribe_any(path, with_punct):
+    # Произвольный файл вне output_audio: только текст, без .txt и записи в манифест этапов
+    resampled = resample_to_model_rate(path)
+    audio_path = resampled or Path(path)
+    try:
+        with asr_lock:
+            raw_text = transcriber.transcribe_file_native(audio_path, state['model'])
+        return {'text': punctuate_text(raw_text) if with_punct else raw_text}
+    finally:
+        if resampled:
+            manifest.clear_chunks(resampled)
+            try: os.remove(resampled)
+            except OSError: pass
+
+def transcribe_path(wav_path, with_punct=True):
+    wav_path = Path(wav_path).resolve()
+    if not wav_path.exists():
+        raise FileNotFoundError(str(wav_path))
+
+    # Файлы из output_audio — обычный этап STT: чекпоинты, .txt и манифест
+    if wav_path.is_relative_to(config.DIR_AUDIO_WAV.resolve()):
+        wav_path = config.DIR_AUDIO_WAV / wav_path.relative_to(config.DIR_AUDIO_WAV.resolve())
+        txt_path = transcriber.get_txt_path(wav_path)
+        if manifest.is_done('stt', txt_path):
+            return {'txt_path': str(txt_path), 'text': txt_path.read_text(encoding='utf-8'), 'cached': True}
+        # Без пунктуации результат этапа не сохраняется: иначе сырой текст навсегда заменил бы
+        # настоящий .txt, и ни 03_transcriber, ни редактор его уже не переделают.
+        # Чекпоинты кусков остаются и пригодятся следующему полному прогону.
+        if not (with_punct and state['punct_model']):
+            with asr_lock:
+                raw_text = transcriber.transcribe_file_native(wav_path, state['model'])
+            return {'text': raw_text}
+        try:
+            with asr_lock:
+                raw_text = transcriber.transcribe_raw(wav_path, state['model'])
+            with punct_lock:
+                txt_path, final_text = transcriber.save_text(wav_path, raw_text, state['punct_model'])
+        except Exception as e:
+            manifest.mark_failed('stt', txt_path, e)
+            raise
+        return {'txt_path': str(txt_path), 'text': final_text}
+
+    return transcribe_any(wav_path, with_punct)
+
+def transcribe_bytes(data, fmt, with_punct=True):
+    # Аудио в теле запроса: wav/flac (другая частота пересэмплируется) или сырой s16
+    suffix = '.s16' if fmt == 's16' else f'.{fmt}'
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(data)
+        tmp_path = f.name
+    try:
+        return transcribe_any(Path(tmp_path), with_punct)
+    finally:
+        manifest.clear_chunks(Path(tmp_path))
+        try: os.remove(tmp_path)
+        except OSError: pass
+
+
+class Handler(BaseHTTPRequestHandler):
+    def _reply(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._reply(200, {'status': 'ok', 'model': config.MODEL_ID, 'revision': config.MODEL_REVISION,
+                              'device': config.DEVICE, 'punctuation': state['punct_model'] is not None})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with_punct = query.get('punctuate', ['1'])[0] != '0'
+        data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        try:
+            if url.path == '/transcribe':
+                result = transcribe_path(json.loads(data)['path'], with_punct)
+            elif url.path == '/transcribe/stream':
+                result = transcribe_bytes(data, query.get('format', ['wav'])[0], with_punct)
+            elif url.path == '/shutdown':
+                self._reply(200, {'status': 'stopping'})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+            else:
+                self._reply(404, {'error': 'not found'})
+                return
+        except BadAudio as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            print(f"[ERR] {url.path}: {e}")
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GigaAM-v3 transcription daemon")
+    parser.add_argument('--host', default=config.STT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=config.STT_SERVER_PORT)
+    parser.add_argument('--no-punct', action='store_true', help='Не загружать модель пунктуации')
+    args = parser.parse_args()
+
+    print(f"--- STT server: {config.MODEL_ID} ({config.MODEL_REVISION}) on {config.DEVICE} ---")
+    state['model'] = transcriber.load_asr_model()
+    state['punct_model'] = None if args.no_punct else transcriber.load_punct_model()
+    manifest.ensure_synced()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print("Stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import re
+import time
+import random
+import argparse
+from difflib import SequenceMatcher
+
+# Сборка текста лекции из текстов кусков. Слова копятся в одном списке,
+# перекрытие соседних окон ищется по словам в ограниченном хвосте/голове,
+# строка собирается один раз в конце -> время линейно по числу кусков.
+
+LOOK_WORDS = 25       # сколько слов хвоста/головы сравнивать (перекрытие 2 с — это ~5-10 слов)
+MIN_MATCH_WORDS = 2   # одно совпавшее слово ("и", "в") — не перекрытие
+
+_norm_re = re.compile(r"[^\w]+")
+
+
+def _norm(word):
+    return _norm_re.sub("", word.lower())
+
+def merge_overlap(words, norms, nxt):
+    # words/norms — уже собранный текст (меняются на месте), nxt — слова следующего куска
+    tail = norms[-LOOK_WORDS:]
+    nxt_norms = [_norm(w) for w in nxt]
+    head = nxt_norms[:LOOK_WORDS]
+    match = SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+
+    if match.size >= MIN_MATCH_WORDS:
+        # Общий фрагмент берем один раз: хвост прошлого куска после него дублирует голову следующего
+        cut = len(words) - len(tail) + match.a + match.size
+        del words[cut:], norms[cut:]
+        start = match.b + match.size
+    else:
+        start = 0
+    words.extend(nxt[start:])
+    norms.extend(nxt_norms[start:])
+
+def assemble(texts, overlapping=True):
+    words, norms = [], []
+    for text in texts:
+        nxt = text.split() if text else []
+        if not nxt: continue
+        if overlapping and words:
+            merge_overlap(words, norms, nxt)
+        else:
+            words.extend(nxt)
+            norms.extend(_norm(w) for w in nxt)
+    return " ".join(words)
+
+
+# --- Микробенчмарк: python transcript.py ---
+
+def _legacy_smart_merge(text1, text2):
+    # Прежний алгоритм 03_transcriber (конкатенация строк + символьный SequenceMatcher)
+    if not text1: return text2
+    if not text2: return text1
+    tail = text1[-min(len(text1), 100):]
+    head = text2[:min(len(text2), 100)]
+    match = SequenceMatcher(None, tail, head).find_longest_match(0, len(tail), 0, len(head))
+    if match.size > 5:
+        return text1 + " " + text2[match.b + match.size:]
+    return text1 + " " + text2
+
+def synthetic_chunks(n_chunks, words_per_chunk=60, overlap_words=6, seed=0):
+    rng = random.Random(seed)
+    vocab = ["".join(rng.choice("абвгдеклмнопрст") for _ in range(rng.randint(2, 9))) for _ in range(5000)]
+    stream = [rng.choice(vocab) for _ in range(n_chunks * (words_per_chunk - overlap_words) + overlap_words)]
+    step = words_per_chunk - overlap_words
+    return [" ".join(stream[i * step:i * step + words_per_chunk]) for i in range(n_chunks)]
+
+def benchmark(sizes, repeat=3):
+    print(f"{'chunks':>8} {'assemble, мс':>14} {'мкс/кусок':>10} {'legacy, мс':>12} {'мкс/кусок':>10}")
+    for n in sizes:
+        texts = synthetic_chunks(n)
+
+        best_new = min(_timeit(lambda: assemble(texts)) for _ in range(repeat))
+
+        def legacy():
+            full = ""
+            for t in texts: full = _legacy_smart_merge(full, t)
+            return full
+        best_old = min(_timeit(legacy) for _ in range(repeat))
+
+        print(f"{n:>8} {best_new * 1e3:>14.1f} {best_new / n * 1e6:>10.1f} {best_old * 1e3:>12.1f} {best_old / n * 1e6:>10.1f}")
+
+def _timeit(fn):
+    start_t = time.perf_counter()
+    fn()
+    return time.perf_counter() - start_t
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcript assembly micro-benchmark")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[250, 1000, 4000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.sizes, args.repeat)
@@ -0,0 +1,92 @@
+import numpy as np
+import config
+import audio_io
+
+# Энергетический VAD: громкость по кадрам -> маска речи -> куски с границами в паузах.
+# Все операции над кадрами векторные, аудио читается блоками (память не зависит от длины записи).
+
+BLOCK_SECONDS = 60
+
+
+def frame_energies(audio, sr, frame_samples):
+    total = audio_io.num_samples(audio)
+    block = frame_samples * max(1, int(BLOCK_SECONDS * sr) // frame_samples)
+    out = []
+    for start in range(0, total, block):
+        data = audio_io.read_chunk(audio, start, min(start + block, total))
+        n = len(data) // frame_samples
+        if n == 0: break
+        frames = data[:n * frame_samples].reshape(n, frame_samples)
+        out.append(10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10))
+    return np.concatenate(out) if out else np.empty(0, dtype=np.float32)
+
+def speech_threshold(db):
+    # Порог относительно шумового пола записи, но не выше "громкой речи" минус запас:
+    # иначе в записи совсем без пауз порог уехал бы в середину речи
+    floor = np.percentile(db, 10)
+    loud = np.percentile(db, 90)
+    return max(min(floor + config.VAD_MARGIN_DB, loud - config.VAD_MARGIN_DB), config.VAD_MIN_DB)
+
+def _runs(mask):
+    d = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(d == 1), np.flatnonzero(d == -1)
+
+def _merge_close(starts, ends, min_gap):
+    if len(starts) == 0: return starts, ends
+    keep = starts[1:] - ends[:-1] >= min_gap
+    return starts[np.r_[True, keep]], ends[np.r_[keep, True]]
+
+def speech_segments(db, frame_sec):
+    # [start, end) в кадрах
+    starts, ends = _runs(db > speech_threshold(db))
+    starts, ends = _merge_close(starts, ends, int(config.VAD_MIN_SILENCE / frame_sec))
+
+    long_enough = ends - starts >= int(config.VAD_MIN_SPEECH / frame_sec)
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    pad = int(config.VAD_PAD / frame_sec)
+    starts = np.maximum(starts - pad, 0)
+    ends = np.minimum(ends + pad, len(db))
+    return _merge_close(starts, ends, 1)
+
+def split_long(db, start, end, max_frames):
+    # Слишком длинная речь режется в самом тихом кадре второй половины окна
+    cuts = []
+    while end - start > max_frames:
+        lo, hi = start + max_frames // 2, start + max_frames
+        cut = lo + int(np.argmin(db[lo:hi]))
+        cuts.append((start, cut))
+        start = cut
+    cuts.append((start, end))
+    return cuts
+
+def pack_chunks(db, starts, ends, max_frames, merge_gap):
+    # Соседние фразы склеиваются в один кусок, пока он не длиннее max_frames
+    # и пауза между ними короткая; длинные паузы всегда становятся границей
+    chunks = []
+    cur_start = cur_end = None
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        if cur_start is not None and e - cur_start <= max_frames and s - cur_end <= merge_gap:
+            cur_end = e
+            continue
+        if cur_start is not None:
+            chunks.extend(split_long(db, cur_start, cur_end, max_frames))
+        cur_start, cur_end = s, e
+    if cur_start is not None:
+        chunks.extend(split_long(db, cur_start, cur_end, max_frames))
+    return chunks
+
+def speech_chunks(audio, sr):
+    # Спаны [start, stop) в сэмплах только для участков с речью
+    frame_samples = int(config.VAD_FRAME_MS * sr / 1000)
+    frame_sec = frame_samples / sr
+    db = frame_energies(audio, sr, frame_samples)
+    if len(db) == 0: return []
+
+    starts, ends = speech_segments(db, frame_sec)
+    chunks = pack_chunks(db, starts, ends,
+                         max_frames=int(config.VAD_MAX_CHUNK / frame_sec),
+                         merge_gap=int(config.VAD_MERGE_GAP / frame_sec))
+
+    total = audio_io.num_samples(audio)
+    return [(s * frame_samples, min(e * frame_samples, total)) for s, e in chunks]